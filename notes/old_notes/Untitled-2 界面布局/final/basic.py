@@ -1,5 +1,6 @@
 import numpy as np
 from PIL import Image, ImageChops
+from functools import lru_cache
 import os
 import yaml
 
@@ -9,46 +10,52 @@ def load_image(image_path):
         raise FileNotFoundError(f"图片文件 {image_path} 不存在")
     return Image.open(image_path)
 
-# 读取npy文件
+# 读取npy文件；.npz 为 generate_npy.py 瓦片模式保存的单个周期（叠加时按坐标取模平铺）
 def load_npy(npy_path, color):
     if not os.path.exists(npy_path):
         raise FileNotFoundError(f"npy文件 {npy_path} 不存在")
-    mask = np.load(npy_path)
+    if npy_path.endswith(".npz"):
+        with np.load(npy_path) as tile:
+            mask = tile["mask"]
+    else:
+        mask = np.load(npy_path)
     height, width = mask.shape
     npy_data = np.zeros((height, width, 4), dtype=np.uint8)
     npy_data[mask==1] = color
     npy_data[mask==0] = [0,0,0,0]
     return npy_data
 
-# 将npy数据覆盖到图片上，并裁剪超出部分
-def overlay_and_crop(base_image, npy_data, final_opacity):
+# 透明度查找表：与 a.point(lambda p: int(p * final_opacity)) 相同，按透明度缓存
+@lru_cache(maxsize=32)
+def opacity_lut(final_opacity):
+    lut = np.array([int(p * final_opacity) for p in range(256)], dtype=np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+# 瓦片模板按坐标取模平铺到 width x height（np.take 的 wrap 模式），没有尺寸上限
+def tile_watermark(tile, width, height):
+    rows = np.take(tile, np.arange(height), axis=0, mode="wrap")
+    return np.take(rows, np.arange(width), axis=1, mode="wrap")
+
+# 将npy数据覆盖到图片上，并裁剪超出部分；tiled 为真时 npy_data 是一个周期的瓦片
+def overlay_and_crop(base_image, npy_data, final_opacity, tiled=False):
     # # 将npy数据转换为PIL图像
     # npy_data = (npy_data * 255).astype(np.uint8)  # 假设npy数据在[0, 1]范围内
-    watermark_image = Image.fromarray(npy_data)
 
-    # 获取图片和水印的尺寸
+    # 获取图片尺寸，裁剪水印超出图片的部分（直接切片，不再整张转换）
     base_width, base_height = base_image.size
-    watermark_width, watermark_height = watermark_image.size
-
-    # 裁剪水印超出图片的部分
-    if watermark_width > base_width or watermark_height > base_height:
-        watermark_image = watermark_image.crop((0, 0, base_width, base_height))
+    if tiled:
+        watermark = tile_watermark(npy_data, base_width, base_height)
+    else:
+        watermark = np.array(npy_data[:base_height, :base_width])
     '''
         算法：
             修改alpha通道透明度
     '''
     
-    # 设置水印透明度
-    # 假设 watermark 是一个 PIL 图像对象
-    watermark_image = watermark_image.convert("RGBA")# 确保图像是 RGBA 模式（带有 alpha 通道）
-    # 分离图像的通道
-    r, g, b, a = watermark_image.split()
-    
-    # 仅对 alpha 通道进行调整
-    a = a.point(lambda p: int(p * final_opacity))# 将 alpha 通道的透明度设置为 final_opacity%    
-    
-    # 重新合并通道
-    watermark_image = Image.merge("RGBA", (r, g, b, a))    
+    # 设置水印透明度：只对裁剪后的 alpha 通道查表，代替 split/point/merge 三次整图处理
+    np.take(opacity_lut(final_opacity), watermark[..., 3], out=watermark[..., 3])
+    watermark_image = Image.fromarray(watermark, "RGBA")
         
     '''
         算法：此时将水印与底图正片叠底
@@ -79,7 +86,9 @@ def generate_watermark(input_image_path, npy_path, final_opacity=50):
     output_width = config['crop']['output_width']
     color = config['color']
     # npy_path = f"watermark_mask_{spacing}.npy"
-    npy_path = f"{npy_path}.npy"
+    # 没有整幅的 .npy 时使用同名的瓦片 .npz
+    tiled = not os.path.exists(f"{npy_path}.npy") and os.path.exists(f"{npy_path}.npz")
+    npy_path = f"{npy_path}.npz" if tiled else f"{npy_path}.npy"
     # final_opacity = config['final_opacity'] / 100.0
     final_opacity = final_opacity / 100.0
 
@@ -95,7 +104,7 @@ def generate_watermark(input_image_path, npy_path, final_opacity=50):
     base_image = base_image.resize((width, 2000))
 
     # 将水印覆盖到图片上，并裁剪超出部分
-    result_image = overlay_and_crop(base_image, npy_data, final_opacity)
+    result_image = overlay_and_crop(base_image, npy_data, final_opacity, tiled)
     scale = output_width / 2000
     width = int(base_image.width * scale)
     result_image=result_image.resize((width, output_width)).convert("RGB")
@@ -1,6 +1,8 @@
 from PIL import Image, ImageDraw, ImageFont, ImageFilter
 import matplotlib.pyplot as plt
 import numpy as np
+import functools
+import math
 import yaml
 
 def find_intersection(line1, line2):
@@ -132,8 +134,284 @@ def draw_dashed_line(draw, start, end, color, shadow_color, dash_length=10, gap_
 
         current_distance += dash_length + gap_length
 
-angle_45 = []
-angle_135= []
+# 光栅器每次输出的行数
+LATTICE_STRIP_ROWS = 256
+
+# 距离场量化：每像素 SDF_SCALE 级（垂直距离最大约 64 像素），沿线的有符号距离以 SDF_ALONG_ZERO 为零点
+SDF_SCALE = 4
+SDF_ALONG_ZERO = 128
+
+def lattice_lines(width, height, angle, spacing):
+    """45°/135° 网格线的端点 (x1, y1, x2, y2)，顺序与 draw_watermark_lines 一致"""
+    if angle == 45:
+        return [(i, 0, i + height, height) for i in range(-height, width, spacing)]
+    return [(i, 0, i - height, height) for i in range(0, width + height, spacing)]
+
+def _dash_segments(line, dash_length, gap_length):
+    """与 draw_dashed_line 相同的浮点运算得到一条线上所有虚线段的端点 (n, 4)，按 C 层的 (int) 向零截断"""
+    x1, y1, x2, y2 = line
+    dx = x2 - x1
+    dy = y2 - y1
+    distance = (dx**2 + dy**2)**0.5
+    dx_unit = dx / distance
+    dy_unit = dy / distance
+    current = np.arange(0, math.ceil(distance), dash_length + gap_length)
+    current = current[current < distance]
+    following = np.minimum(current + dash_length, distance)
+    segments = np.stack([x1 + dx_unit * current, y1 + dy_unit * current,
+                         x1 + dx_unit * following, y1 + dy_unit * following], axis=1)
+    # 理论上恰为整数的端点（snap_dash_period 调整后每个周期都会出现）按整数处理，
+    # 避免 73.99999999 被截断成 73，使相差整数个周期的线段取整结果相同，瓦片才能无缝平铺
+    nearest = np.round(segments)
+    segments = np.where(np.abs(segments - nearest) < 1e-6, nearest, segments)
+    return np.trunc(segments).astype(np.int64)
+
+def _line_footprint(dx, dy, width):
+    """PIL 宽线 (0, 0)-(dx, dy) 覆盖的像素偏移 (rows, cols)；宽线像素集合只取决于取整后的端点差，可整数平移复用"""
+    pad = width + 2
+    canvas = Image.new("L", (abs(dx) + 2 * pad + 1, abs(dy) + 2 * pad + 1), 0)
+    x0, y0 = pad + max(-dx, 0), pad + max(-dy, 0)
+    ImageDraw.Draw(canvas).line([(x0, y0), (x0 + dx, y0 + dy)], fill=255, width=width)
+    rows, cols = np.nonzero(np.array(canvas))
+    return rows - y0, cols - x0
+
+def _clipped_line_pixels(segment, width, canvas_width, canvas_height):
+    """跨出画布边缘的宽线实际覆盖的像素 (rows, cols)：PIL 对越界的宽线多边形按画布裁剪后取整，
+    边缘附近的像素集合不等于平移后的足迹，这类线段在与画布同边界的小画布上单独绘制"""
+    x1, y1, x2, y2 = segment
+    pad = width + 2
+    left, top = max(min(x1, x2) - pad, 0), max(min(y1, y2) - pad, 0)
+    right, bottom = min(max(x1, x2) + pad + 1, canvas_width), min(max(y1, y2) + pad + 1, canvas_height)
+    if right <= left or bottom <= top:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    canvas = Image.new("L", (right - left, bottom - top), 0)
+    ImageDraw.Draw(canvas).line([(x1 - left, y1 - top), (x2 - left, y2 - top)], fill=255, width=width)
+    rows, cols = np.nonzero(np.array(canvas))
+    return rows + top, cols + left
+
+class DashedLattice:
+    """矢量化的 45°/135° 虚线网格光栅器，按行条带输出 RGBA
+
+    精确模式与 draw_watermark_lines（先 45° 后 135°，每段先画阴影再画主线）逐像素一致（RGBA 与掩码）：
+    每种取整后的线段形状只用 PIL 画一次得到像素偏移，所有同形状线段用 NumPy 广播平移；
+    跨出画布边缘的线段按 PIL 的裁剪结果单独绘制（见 _clipped_line_pixels）；
+    每个像素记录最后一次覆盖它的绘制序号（np.maximum.at），再按序号奇偶取主线或阴影颜色。
+    antialias 为真时改用坐标的模运算直接求覆盖度：到最近线的垂直距离、沿线位置对虚线周期取模，得到抗锯齿的边缘
+    """
+
+    def __init__(self, width, height, spacing, color, shadow_color, dash_length=10, line_width=6,
+                 gap_length=5, shadow_extra=10, background=(0, 0, 0, 0), antialias=False):
+        self.width, self.height = width, height
+        self.background = np.array(background, dtype=np.uint8)
+        self.spacing = spacing
+        self.color = np.array(color, dtype=np.uint8)
+        self.shadow_color = np.array(shadow_color, dtype=np.uint8)
+        self.dash_length, self.gap_length = dash_length, gap_length
+        self.line_width, self.shadow_width = line_width, line_width + shadow_extra
+        self.antialias = antialias
+        if not antialias:
+            self._prepare_stamps()
+
+    def _prepare_stamps(self):
+        segments = np.concatenate([_dash_segments(line, self.dash_length, self.gap_length)
+                                   for angle in (45, 135)
+                                   for line in lattice_lines(self.width, self.height, angle, self.spacing)])
+        # 绘制顺序：第 n 段的阴影序号为 2n + 1，主线为 2n + 2（0 表示未覆盖）
+        order = np.arange(1, 2 * len(segments) + 1, 2, dtype=np.int32)
+        shapes, inverse = np.unique(segments[:, 2:] - segments[:, :2], axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        self.groups = []
+        edges = []
+        for index, (dx, dy) in enumerate(shapes.tolist()):
+            members = np.flatnonzero(inverse == index)
+            # 按起点行排序，渲染条带时用二分查找取出相交的线段
+            members = members[np.argsort(segments[members, 1], kind="stable")]
+            for width, offset in ((self.shadow_width, 0), (self.line_width, 1)):
+                rows, cols = _line_footprint(dx, dy, width)
+                if not rows.size:
+                    continue
+                x, y = segments[members, 0], segments[members, 1]
+                inside = ((x + cols.min() >= 0) & (x + cols.max() < self.width)
+                          & (y + rows.min() >= 0) & (y + rows.max() < self.height))
+                # 条带内的扁平下标不超过 int32，用 int32 减少内存带宽
+                self.groups.append((x[inside].astype(np.int32), y[inside].astype(np.int32),
+                                    rows.astype(np.int32), cols.astype(np.int32), order[members[inside]] + offset))
+                for member in members[~inside].tolist():
+                    edge_rows, edge_cols = _clipped_line_pixels(segments[member].tolist(), width,
+                                                                self.width, self.height)
+                    edges.append((edge_rows, edge_cols, np.full(edge_rows.size, order[member] + offset, np.int32)))
+        # 画布边缘线段的像素按行排序，渲染条带时二分取出
+        edge_rows, edge_cols, edge_order = (np.concatenate(parts) for parts in zip(*edges)) if edges else (
+            np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32))
+        by_row = np.argsort(edge_rows, kind="stable")
+        self.edges = (edge_rows[by_row], edge_cols[by_row], edge_order[by_row])
+        # 序号 -> 颜色：0 为背景，奇数为阴影，偶数为主线；RGBA 按 uint32 查表
+        self.palette = np.stack([self.background, self.shadow_color, self.color]).view(np.uint32).ravel()
+
+    def render(self, top=0, bottom=None):
+        """返回 [top, bottom) 行的 RGBA 条带 (bottom - top, width, 4) uint8"""
+        bottom = self.height if bottom is None else bottom
+        if self.antialias:
+            return self._render_antialiased(top, bottom)
+        rows_total = bottom - top
+        latest = np.zeros(rows_total * self.width, dtype=np.int32)
+        for start_x, start_y, rows, cols, order in self.groups:
+            # 只取与条带相交的线段
+            hit = slice(np.searchsorted(start_y, top - rows.max()), np.searchsorted(start_y, bottom - rows.min()))
+            if hit.start >= hit.stop:
+                continue
+            x, y, seq = start_x[hit], start_y[hit] - top, order[hit]
+            # 完全落在条带内的线段直接用扁平下标平移；跨越条带或画布边缘的线段逐像素裁剪
+            whole = ((y + rows.min() >= 0) & (y + rows.max() < rows_total)
+                     & (x + cols.min() >= 0) & (x + cols.max() < self.width))
+            index = ((y[whole] * self.width + x[whole])[:, None] + (rows * self.width + cols)).ravel()
+            np.maximum.at(latest, index, np.repeat(seq[whole], rows.size))
+            if not whole.all():
+                edge = ~whole
+                py = y[edge, None] + rows
+                px = x[edge, None] + cols
+                inside = (py >= 0) & (py < rows_total) & (px >= 0) & (px < self.width)
+                np.maximum.at(latest, (py * self.width + px)[inside],
+                              np.broadcast_to(seq[edge, None], inside.shape)[inside])
+        edge_rows, edge_cols, edge_order = self.edges
+        hit = slice(np.searchsorted(edge_rows, top), np.searchsorted(edge_rows, bottom))
+        np.maximum.at(latest, (edge_rows[hit] - top) * self.width + edge_cols[hit], edge_order[hit])
+        # 0 -> 背景，奇数 -> 阴影 (1)，偶数 -> 主线 (2)
+        index = np.where(latest > 0, 2 - (latest & 1), 0)
+        return np.take(self.palette, index).view(np.uint8).reshape(rows_total, self.width, 4)
+
+    def _dash_distance(self, along):
+        """沿线距离 along 处到虚线段边界的有符号距离：段内为正，间隔内为负"""
+        period = self.dash_length + self.gap_length
+        phase = np.mod(along, period)
+        return np.where(phase <= self.dash_length, np.minimum(phase, self.dash_length - phase),
+                        -np.minimum(phase - self.dash_length, period - phase))
+
+    def _coverage(self, along, across, width):
+        """沿线距离 along、到线的垂直距离 across 处的覆盖度：线宽方向与虚线方向各有 1 像素的线性过渡"""
+        return np.clip(self._dash_distance(along) + 0.5, 0, 1) * np.clip(width / 2 + 0.5 - np.abs(across), 0, 1)
+
+    def _line_coordinates(self, top, bottom):
+        """依次返回 45°、135° 两组线的 (along, across)：像素中心在最近一条线上的垂足到起点的距离、到该线的有符号垂直距离"""
+        y = np.arange(top, bottom, dtype=np.float64)[:, None] + 0.5
+        x = np.arange(self.width, dtype=np.float64)[None, :] + 0.5
+        # 45° 线满足 x - y = -height + k * spacing，135° 线满足 x + y = k * spacing，起点都在 y = 0
+        for sign, origin in ((-1, -self.height), (1, 0)):
+            offset = np.mod(x + sign * y - origin + self.spacing / 2, self.spacing) - self.spacing / 2
+            yield (y - sign * offset / 2) * np.sqrt(2), offset / np.sqrt(2)
+
+    def distance_field(self, top=0, bottom=None):
+        """返回 [top, bottom) 行的距离场 (bottom - top, width, 4) uint8
+
+        通道依次为 45° 线的垂直距离、沿线到虚线段边界的有符号距离，135° 线的同样两项；
+        距离按 SDF_SCALE 量化，垂直距离超出范围时取 255，沿线距离加 SDF_ALONG_ZERO 偏置（段内为正）
+        """
+        bottom = self.height if bottom is None else bottom
+        field = np.empty((bottom - top, self.width, 4), dtype=np.uint8)
+        for channel, (along, across) in zip((0, 2), self._line_coordinates(top, bottom)):
+            field[..., channel] = np.clip(np.round(np.abs(across) * SDF_SCALE), 0, 255)
+            field[..., channel + 1] = np.clip(np.round(self._dash_distance(along) * SDF_SCALE) + SDF_ALONG_ZERO, 0, 255)
+        return field
+
+    def _render_antialiased(self, top, bottom):
+        rgba = np.empty((bottom - top, self.width, 4), dtype=np.float64)
+        rgba[:] = self.background
+        for along, across in self._line_coordinates(top, bottom):
+            for color, width in ((self.shadow_color, self.shadow_width), (self.color, self.line_width)):
+                # 与 PIL 的覆盖写入一致：覆盖度为 1 时直接取线的颜色，边缘按覆盖度混合
+                coverage = self._coverage(along, across, width)[..., None]
+                rgba += (color - rgba) * coverage
+        return np.round(rgba).astype(np.uint8)
+
+def lattice_intersections(width, height, spacing, step=2):
+    """45°/135° 网格线（各取每隔 step 条）的全部交点，(k, 2) 的 float 数组
+
+    135° 线满足 x + y = a，45° 线满足 x - y = b，交点为 ((a + b) / 2, (a - b) / 2)，
+    与 find_intersection 的结果逐位相同；两条线都纵贯整幅图，交点落在线段上当且仅当 b <= a <= b + 2 * height。
+    顺序与逐对遍历（135° 线在外层）一致，只生成有效交点，开销 O(k)
+    """
+    a = np.array([line[0] for line in lattice_lines(width, height, 135, spacing)[::step]], dtype=np.int64)
+    b = np.array([line[0] for line in lattice_lines(width, height, 45, spacing)[::step]], dtype=np.int64)
+    # b 递增，每条 135° 线对应的有效 b 是一段连续区间 [a - 2 * height, a]
+    first = np.searchsorted(b, a - 2 * height, side="left")
+    last = np.searchsorted(b, a, side="right")
+    counts = np.maximum(last - first, 0)
+    rows = np.repeat(np.arange(len(a)), counts)
+    cols = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    a, b = a[rows], b[cols]
+    return np.stack([(a + b) / 2, (a - b) / 2], axis=1)
+
+def segment_intersections(first, second, cell_size=None, eps=1e-9):
+    """任意两组线段 (n, 4)、(m, 4) 之间的交点，返回 (交点 (k, 2), first 下标, second 下标)
+
+    每条线段沿自身走一遍网格（DDA：依次经过与竖直、水平网格线的交点），登记它实际经过的单元，
+    只在共享单元的线段对之间求交；长对角线只占 O(长度 / 单元边长) 个单元，而不是包围盒的 O(长 x 宽)。
+    平行（含共线）线段视为无交点，结果按 (first 下标, second 下标) 排序，与逐对遍历的顺序一致
+    """
+    first = np.asarray(first, dtype=np.float64).reshape(-1, 4)
+    second = np.asarray(second, dtype=np.float64).reshape(-1, 4)
+    empty = (np.empty((0, 2)), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+    if len(first) == 0 or len(second) == 0:
+        return empty
+
+    both = np.concatenate([first, second])
+    if cell_size is None:
+        # 默认单元边长取线段包围盒的平均尺寸，每条线段大致只经过少数几个单元
+        extents = np.maximum(np.abs(both[:, 2] - both[:, 0]), np.abs(both[:, 3] - both[:, 1]))
+        cell_size = max(float(extents.mean()), 1.0)
+    origin_x = min(both[:, 0].min(), both[:, 2].min())
+    origin_y = min(both[:, 1].min(), both[:, 3].min())
+
+    def cells(segments):
+        # 线段经过的所有单元（含只擦过边或角的单元），展开为 (单元编号, 线段下标)
+        x0, x1 = (segments[:, 0] - origin_x) / cell_size, (segments[:, 2] - origin_x) / cell_size
+        y0, y1 = (segments[:, 1] - origin_y) / cell_size, (segments[:, 3] - origin_y) / cell_size
+        owners, xs, ys = [np.arange(len(segments))] * 2, [x0, x1], [y0, y1]
+        for a0, a1, b0, b1, along_x in ((x0, x1, y0, y1, True), (y0, y1, x0, x1, False)):
+            # 与 a = k（k 为整数）网格线的全部交点；a 方向不变的线段没有这类交点
+            low, high = np.ceil(np.minimum(a0, a1)), np.floor(np.maximum(a0, a1))
+            counts = np.where(a0 != a1, np.maximum(high - low + 1, 0), 0).astype(np.int64)
+            owner = np.repeat(np.arange(len(segments)), counts)
+            k = np.repeat(low, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+            b = b0[owner] + (k - a0[owner]) / (a1 - a0)[owner] * (b1 - b0)[owner]
+            owners.append(owner)
+            xs.append(k if along_x else b)
+            ys.append(b if along_x else k)
+        owner, x, y = np.concatenate(owners), np.concatenate(xs), np.concatenate(ys)
+        # 端点与网格线交点处于边界上，两侧的单元都登记；容差吸收交点坐标的舍入误差
+        tolerance = 1e-6
+        keys, owner_keys = [], []
+        for cx in (np.floor(x - tolerance), np.floor(x + tolerance)):
+            for cy in (np.floor(y - tolerance), np.floor(y + tolerance)):
+                # 单元编号用 (cx, cy) 拼成一个整数键，cy 的取值范围有限
+                keys.append(cx.astype(np.int64) * (1 << 32) + cy.astype(np.int64))
+                owner_keys.append(owner)
+        pairs = np.unique(np.stack([np.concatenate(keys), np.concatenate(owner_keys)], axis=1), axis=0)
+        return pairs[:, 0], pairs[:, 1]
+
+    keys_a, owner_a = cells(first)
+    keys_b, owner_b = cells(second)
+    order = np.argsort(keys_b, kind="stable")
+    keys_b, owner_b = keys_b[order], owner_b[order]
+    start = np.searchsorted(keys_b, keys_a, side="left")
+    counts = np.searchsorted(keys_b, keys_a, side="right") - start
+    i = np.repeat(owner_a, counts)
+    j = owner_b[np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+    # 同一对线段可能共享多个单元，去重后即按 (i, j) 排序
+    pairs = np.unique(i * len(second) + j)
+    i, j = pairs // len(second), pairs % len(second)
+
+    p, r = first[i, :2], first[i, 2:] - first[i, :2]
+    q, s = second[j, :2], second[j, 2:] - second[j, :2]
+    denominator = r[:, 0] * s[:, 1] - r[:, 1] * s[:, 0]
+    qp = q - p
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (qp[:, 0] * s[:, 1] - qp[:, 1] * s[:, 0]) / denominator
+        u = (qp[:, 0] * r[:, 1] - qp[:, 1] * r[:, 0]) / denominator
+    hit = (denominator != 0) & (t >= -eps) & (t <= 1 + eps) & (u >= -eps) & (u <= 1 + eps)
+    if not hit.any():
+        return empty
+    return p[hit] + t[hit, None] * r[hit], i[hit], j[hit]
 
 def draw_watermark_lines(image, angle, color, shadow_color, dash_length=10, line_width=6, spacing=50, emboss=True):
     """
@@ -146,7 +424,6 @@ def draw_watermark_lines(image, angle, color, shadow_color, dash_length=10, line
     """
     width, height = image.size
     draw = ImageDraw.Draw(image)
-    index = 0
     if angle == 45:
         # pass
         # # 45度线：从左上到右下
@@ -160,9 +437,6 @@ def draw_watermark_lines(image, angle, color, shadow_color, dash_length=10, line
         #         draw_dashed_line(draw, (i, 0), (i + height - 2, height - 2), light_color, width=2)
         #     # 绘制主虚线
             draw_dashed_line(draw, (i, 0), (i + height, height), color,shadow_color,dash_length=dash_length, width=line_width, negtive=False)
-            if index%2==0:
-                angle_45.append((i, 0, i + height, height))
-            index+=1
             
     elif angle == 135:
         # 135度线：从右上到左下
@@ -176,9 +450,38 @@ def draw_watermark_lines(image, angle, color, shadow_color, dash_length=10, line
                 # draw_dashed_line(draw, (i, 0), (i - height, height), light_color, width=2)
             # 绘制主虚线
             draw_dashed_line(draw, (i, 0), (i - height, height), color,shadow_color,dash_length=dash_length, width=line_width, negtive=True)
-            if index%2==0:
-                angle_135.append((i, 0, i - height, height))
-            index+=1
+# 文字印章图集的容量：一次生成只用到一种文字、一个字体和少数几种坐标小数部分，LRU 淘汰保证常驻内存有界
+STAMP_ATLAS_SIZE = 256
+
+@functools.lru_cache(maxsize=STAMP_ATLAS_SIZE)
+def get_stamp_mask(text, font, fraction):
+    """返回与 draw.text 在小数偏移 fraction（0 <= f < 1）处渲染一致的 L 模式掩码，以及掩码左上角相对取整坐标的偏移
+
+    掩码与颜色无关，颜色在叠加时给出；同一 (文字, 字体对象, 小数偏移) 只调用一次 FreeType
+    """
+    left, top, right, bottom = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox((0, 0), text, font=font)
+    pad = max(-left, -top, 0) + 2
+    canvas = Image.new("L", (right + pad + 2, bottom + pad + 2), 0)
+    ImageDraw.Draw(canvas).text((pad + fraction[0], pad + fraction[1]), text, font=font, fill=255)
+    bbox = canvas.getbbox() or (0, 0, 0, 0)
+    return canvas.crop(bbox), (bbox[0] - pad, bbox[1] - pad)
+
+def draw_stamps(image, text, font, positions, passes):
+    """在每个位置依次绘制 passes 中的 ((dx, dy), 颜色)，结果与逐个调用 draw.text 一致
+
+    掩码取自图集，用 paste(颜色, 位置, 掩码) 贴到画布上，混合运算与 draw.text 相同；
+    负坐标且带小数时 FreeType 的渲染结果不等于平移，这类印章直接调用 draw.text
+    """
+    draw = ImageDraw.Draw(image)
+    for x, y in positions:
+        for (dx, dy), fill in passes:
+            fraction = (math.modf(x + dx)[0], math.modf(y + dy)[0])
+            if fraction[0] < 0 or fraction[1] < 0:
+                draw.text((x + dx, y + dy), text, font=font, fill=fill)
+                continue
+            mask, (ox, oy) = get_stamp_mask(text, font, fraction)
+            image.paste(fill, (int(x + dx) + ox, int(y + dy) + oy), mask)
+
 def draw_foggy(image, angle, color, line_width=6, spacing=50):
     """
     在图片上绘制指定角度的水印线
@@ -206,18 +509,32 @@ def draw_foggy(image, angle, color, line_width=6, spacing=50):
             fill=color, width=line_width
             )
 
-def main():
+# 虚线默认的间隔长度（与 draw_dashed_line 一致）
+GAP_LENGTH = 5
 
-    # 打开并读取YAML文件
-    with open('config.yaml', 'r') as file:
-        # 加载并解析YAML内容
-        config = yaml.safe_load(file)
-    # 创建一个空白图片
-    width, height = 6000, 6000
+def snap_dash_period(spacing, dash_length, gap_length=GAP_LENGTH):
+    """把虚线周期（线长 + 间隔）等比例缩放到能整除一个瓦片周期的沿线长度，返回 (线长, 间隔)
+
+    网格沿水平方向天然以 2 * spacing 为周期（所有线都从 y = 0 开始分段）；竖直方向平移 2 * spacing
+    相当于沿 45°/135° 线走 2 * spacing * sqrt(2)，虚线周期整除它时整幅水印才是 2 * spacing 见方的周期图案
+    """
+    period = dash_length + gap_length
+    along = 2 * spacing * math.sqrt(2)
+    scale = along / max(round(along / period), 1) / period
+    return dash_length * scale, gap_length * scale
+
+# 雾化层的高斯模糊半径；流式生成时条带上下各多渲染 FOGGY_BLUR_OVERLAP 行，保证模糊结果与整幅一致
+FOGGY_BLUR_RADIUS = 20
+FOGGY_BLUR_OVERLAP = 3 * FOGGY_BLUR_RADIUS
+
+def iter_watermark_strips(config, width, height, dash_length, gap_length=GAP_LENGTH, draw_lattice=True,
+                          strip_rows=None):
+    """按配置逐条带生成 width x height 的网格水印（虚线网格 + 交点文字），依次返回 (起始行, RGBA 条带图片)
+
+    strip_rows 为 None 时整幅一次生成。每个条带在上下各多渲染一段重叠区（覆盖跨越条带边界的文字与雾化模糊的范围）
+    再裁掉，拼接结果与整幅生成逐像素一致，峰值内存只取决于条带大小；draw_lattice 为假时只画交点文字
+    """
     background_color = (255, 255, 255, 0)  # 纯白色背景
-    image = Image.new('RGBA', (width, height), background_color)
-    draw = ImageDraw.Draw(image)
-    image_foggy = Image.new('RGBA', (width, height), background_color)
     watermark_text = 'BH'
     spacing = config['spacing']
     opacity = config['opacity']
@@ -226,73 +543,147 @@ def main():
     shadow_opacity = int(shadow_opacity/100*255)
     line_width = config['line_width']
     foggy_line_width = config['foggy_line_width']
-    dash_length = config['dash_length']
     color = (200, 200, 200, opacity)
     shadow_color = (200,200, 200, shadow_opacity)
     # 设置字体和大小
     font = ImageFont.truetype('arial.ttf', 60)
-    # 绘制45度水印线
-    draw_watermark_lines(image, angle=45, color=color, shadow_color=shadow_color, dash_length=dash_length, spacing=spacing, emboss=True, line_width=line_width)  # 白色半透明
-    # draw_watermark_lines(image, angle=45, color=(255, 0, 0, opacity), shadow_color=shadow_color, spacing=spacing, emboss=True, line_width=line_width)  # 白色半透明
-    # draw_foggy(image_foggy,angle=45,color=color,line_width=foggy_line_width, spacing=spacing)
-
-    # 绘制135度水印线
-    # draw_watermark_lines(image, angle=135, color=(255, 255, 255, 128), spacing=50, emboss=True)  # 红色半透明
-    draw_watermark_lines(image, angle=135, color=color, shadow_color=shadow_color, dash_length=dash_length, spacing=spacing, emboss=True, line_width=line_width)  # 白色半透明
-    # draw_watermark_lines(image, angle=135, color=(0, 0, 255, opacity), shadow_color=shadow_color, spacing=spacing, emboss=True, line_width=line_width)  # 白色半透明
-    # draw_foggy(image_foggy,angle=135,color=color,line_width=foggy_line_width, spacing=spacing)
-    intersections = []
-    # 计算所有交点
-    for i in range(len(angle_135)):
-        for j in range(len(angle_45)):
-            # 示例线段
-            line1 = angle_135[i]
-            line2 = angle_45[j]
-            intersection = find_intersection(line1, line2)
-
-            # # 绘制线段和交点
-            # plot_lines_and_intersection(line1, line2)
-            if intersection:
-                intersections.append(intersection)
-                x=intersection[0]
-                y=intersection[1]
-                # plt.scatter(intersection[0], intersection[1], color="red", zorder=5)
-                # 获取文本的边界框
-                bbox = draw.textbbox((0, 0), watermark_text, font=font)
-
-                # 计算文本的宽度和高度
-                text_width = bbox[2] - bbox[0]  # right - left
-                text_height = bbox[3] - bbox[1]  # bottom - top
-                x =x-text_width/2
-                y=y-text_height/2
-                draw.text((x + 2, y + 2), watermark_text, font=font, fill=shadow_color)
-                draw.text((x - 2, y - 2), watermark_text, font=font, fill=shadow_color)
-                draw.text((x - 2, y + 2), watermark_text, font=font, fill=shadow_color)
-                draw.text((x + 2, y - 2), watermark_text, font=font, fill=shadow_color)
-                draw.text((x, y), watermark_text, font=font, fill=shadow_color)
-    # # 显示图片
-    # plt.imshow(image)
-    # plt.title("image")
-    # plt.axis('off')  # 隐藏坐标轴
-    # plt.show()  
-    # blurred_image = image.filter(ImageFilter.GaussianBlur(radius=10))
-    blurred_image = image_foggy.filter(ImageFilter.GaussianBlur(radius=20))
-    # # 显示图片
-    # plt.imshow(blurred_image)
-    # plt.title("blurred_image")
-    # plt.axis('off')  # 隐藏坐标轴
-    # plt.show()
-    
+    # 绘制45度与135度水印线：矢量化光栅器按行条带输出，结果与 draw_watermark_lines 逐段绘制一致
+    # （antialias 为真时改为抗锯齿的解析覆盖度）
+    lattice = None
+    if draw_lattice:
+        lattice = DashedLattice(width, height, spacing, color, shadow_color, dash_length=dash_length,
+                                line_width=line_width, gap_length=gap_length, background=background_color,
+                                antialias=config.get('antialias', False))
+    # 获取文本的边界框（所有交点的文字相同，只算一次）
+    bbox = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox((0, 0), watermark_text, font=font)
+    # 计算文本的宽度和高度
+    text_width = bbox[2] - bbox[0]  # right - left
+    text_height = bbox[3] - bbox[1]  # bottom - top
+    # 交点只用每隔一条的线，直接由线的偏移量算出，代替逐对调用 find_intersection
+    intersections = lattice_intersections(width, height, spacing)
+    positions = intersections - (text_width / 2, text_height / 2)
+    # 文字（含 ±2 的阴影与取整）在竖直方向伸出定位点的范围
+    stamp_margin = bbox[3] - min(bbox[1], 0) + 4
+    overlap = max(stamp_margin, FOGGY_BLUR_OVERLAP)
 
+    strip_rows = strip_rows or height
+    for top in range(0, height, strip_rows):
+        bottom = min(top + strip_rows, height)
+        # 画布为条带加上下重叠区；第一条从第 0 行开始，坐标与整幅生成相同
+        canvas_top, canvas_bottom = max(top - overlap, 0), min(bottom + overlap, height)
+        rows = canvas_bottom - canvas_top
+        image_foggy = Image.new('RGBA', (width, rows), background_color)
+        if lattice is not None:
+            pixels = np.empty((rows, width, 4), dtype=np.uint8)
+            for row in range(canvas_top, canvas_bottom, LATTICE_STRIP_ROWS):
+                pixels[row - canvas_top:row - canvas_top + LATTICE_STRIP_ROWS] = lattice.render(
+                    row, min(row + LATTICE_STRIP_ROWS, canvas_bottom))
+            image = Image.fromarray(pixels, "RGBA")
+            del pixels
+        else:
+            image = Image.new('RGBA', (width, rows), background_color)
+        # draw_foggy(image_foggy,angle=45,color=color,line_width=foggy_line_width, spacing=spacing)
+        # draw_foggy(image_foggy,angle=135,color=color,line_width=foggy_line_width, spacing=spacing)
+        # 只画可能落入条带的文字；这些文字在画布中的坐标非负，整数平移不改变 draw_stamps 的取整结果
+        visible = (positions[:, 1] > top - stamp_margin) & (positions[:, 1] < bottom + stamp_margin)
+        # 四个方向的阴影加正文，印章掩码只渲染一次
+        draw_stamps(image, watermark_text, font, (positions[visible] - (0, canvas_top)).tolist(),
+                    [((2, 2), shadow_color), ((-2, -2), shadow_color), ((-2, 2), shadow_color),
+                     ((2, -2), shadow_color), ((0, 0), shadow_color)])
+        # # 显示图片
+        # plt.imshow(image)
+        # plt.title("image")
+        # plt.axis('off')  # 隐藏坐标轴
+        # plt.show()  
+        # blurred_image = image.filter(ImageFilter.GaussianBlur(radius=10))
+        blurred_image = image_foggy.filter(ImageFilter.GaussianBlur(radius=FOGGY_BLUR_RADIUS))
+        # # 显示图片
+        # plt.imshow(blurred_image)
+        # plt.title("blurred_image")
+        # plt.axis('off')  # 隐藏坐标轴
+        # plt.show()
 
-    # 将模糊后的图像与原始图像叠加
-    final_image = Image.alpha_composite(image, blurred_image)
-    # # 显示图片
-    # plt.imshow(final_image)
-    # plt.title("45度和135度虚线水印（凹陷特效）")
-    # plt.axis('off')  # 隐藏坐标轴
-    # plt.show()
-    
+        # 将模糊后的图像与原始图像叠加
+        final_image = Image.alpha_composite(image, blurred_image)
+        del image, image_foggy, blurred_image
+        # # 显示图片
+        # plt.imshow(final_image)
+        # plt.title("45度和135度虚线水印（凹陷特效）")
+        # plt.axis('off')  # 隐藏坐标轴
+        # plt.show()
+        if (canvas_top, canvas_bottom) != (top, bottom):
+            final_image = final_image.crop((0, top - canvas_top, width, bottom - canvas_top))
+        yield top, final_image
+
+def render_watermark(config, width, height, dash_length, gap_length=GAP_LENGTH, draw_lattice=True):
+    """按配置整幅生成 width x height 的网格水印，返回 RGBA 图片；draw_lattice 为假时只画交点文字"""
+    (_, final_image), = iter_watermark_strips(config, width, height, dash_length, gap_length, draw_lattice)
+    return final_image
+
+def render_watermark_tile(config):
+    """按配置生成一个周期（2 * spacing 见方）的 RGBA 瓦片，返回 (瓦片数组, 线长, 间隔)
+
+    虚线周期经 snap_dash_period 调整；在 3 倍周期的画布上生成，取中间一块，保证跨越瓦片边界的线段与文字完整。
+    平铺结果与同样线长、间隔、高度为周期整数倍的整幅生成逐像素一致，
+    只有整幅图边缘阴影线宽以内的像素不同（那里的线段被截断）
+    """
+    spacing = config['spacing']
+    period = 2 * spacing
+    dash_length, gap_length = snap_dash_period(spacing, config['dash_length'])
+    canvas = np.array(render_watermark(config, 3 * period, 3 * period, dash_length, gap_length))
+    return np.ascontiguousarray(canvas[period:2 * period, period:2 * period]), dash_length, gap_length
+
+def main():
+
+    # 打开并读取YAML文件
+    with open('config.yaml', 'r') as file:
+        # 加载并解析YAML内容
+        config = yaml.safe_load(file)
+    spacing = config['spacing']
+    if config.get('tile', False):
+        # 瓦片模式：只保存一个周期的图案，加载时按坐标取模平铺到任意尺寸
+        period = 2 * spacing
+        tile, dash_length, gap_length = render_watermark_tile(config)
+        mask = (tile[..., 3] != 0).astype(np.uint8)
+        np.savez(f"watermark_mask_{spacing}.npz", mask=mask, rgba=tile, period=np.array([period, period]),
+                 spacing=spacing, dash_length=dash_length, gap_length=gap_length)
+        print(f"水印瓦片已保存为 watermark_mask_{spacing}.npz", tile.shape)
+        return
+    if config.get('sdf', False):
+        # 距离场模式：保存一个周期的网格距离场与交点文字层，线宽、边缘柔化与雾化在叠加时按参数换算。
+        # 网格按抗锯齿的解析几何编码，与逐段绘制的瓦片在虚线段端点处不一致（误差见 config.yaml 中 sdf 的说明）
+        period = 2 * spacing
+        dash_length, gap_length = snap_dash_period(spacing, config['dash_length'])
+        opacity = int(config['opacity']/100*255)
+        shadow_opacity = int(config['shadow_opacity']/100*255)
+        lattice = DashedLattice(period, period, spacing, (200, 200, 200, opacity), (200, 200, 200, shadow_opacity),
+                                dash_length=dash_length, line_width=config['line_width'], gap_length=gap_length,
+                                antialias=True)
+        canvas = np.array(render_watermark(config, 3 * period, 3 * period, dash_length, gap_length,
+                                           draw_lattice=False))
+        stamps = np.ascontiguousarray(canvas[period:2 * period, period:2 * period])
+        np.savez(f"watermark_sdf_{spacing}.npz", field=lattice.distance_field(), stamps=stamps,
+                 period=np.array([period, period]), spacing=spacing, dash_length=dash_length, gap_length=gap_length,
+                 scale=SDF_SCALE, along_zero=SDF_ALONG_ZERO, color=lattice.color, shadow_color=lattice.shadow_color,
+                 line_width=lattice.line_width, shadow_width=lattice.shadow_width,
+                 fog_width=config['foggy_line_width'], fog_radius=20)
+        print(f"水印距离场已保存为 watermark_sdf_{spacing}.npz", stamps.shape)
+        return
+
+    size = config.get('template_size', 6000)
+    if config.get('stream', False):
+        # 流式模式：按条带生成，掩码直接写入内存映射的 .npy，峰值内存只取决于 stream_rows；不保存 PNG 预览
+        mask = np.lib.format.open_memmap(f"watermark_mask_{spacing}.npy", mode="w+", dtype=np.uint8,
+                                         shape=(size, size))
+        for top, strip in iter_watermark_strips(config, size, size, config['dash_length'],
+                                                strip_rows=config.get('stream_rows', 512)):
+            mask[top:top + strip.height] = np.array(strip.getchannel("A")) != 0
+        mask.flush()
+        del mask
+        print(f"水印图片已保存为 watermark_mask_{spacing}.npy")
+        return
+
+    final_image = render_watermark(config, size, size, config['dash_length'])
     rotated_np = np.array(final_image)
     # 提取 alpha 通道（第 4 个通道）
     alpha_channel = rotated_np[:,:,3]
@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+from PIL import ImageFont
+
+# 测试按 main.py 的方式以 final 目录为导入根（import generate_npy）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def arial(tmp_path, monkeypatch):
+    """iter_watermark_strips 按相对路径加载 arial.ttf：把 Pillow 内置的默认字体写到临时目录并切换过去"""
+    (tmp_path / "arial.ttf").write_bytes(ImageFont.load_default(30).path.getvalue())
+    monkeypatch.chdir(tmp_path)
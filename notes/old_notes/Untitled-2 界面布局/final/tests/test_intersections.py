@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from generate_npy import find_intersection, lattice_intersections, lattice_lines, segment_intersections
+
+
+@pytest.mark.parametrize("width, height, spacing", [(300, 200, 50), (257, 331, 37), (120, 400, 90)])
+def test_lattice_intersections_match_pairwise_loop(width, height, spacing):
+    """与原来逐对调用 find_intersection 的循环（135° 线在外层，各取每隔一条）结果与顺序相同"""
+    expected = []
+    for line1 in lattice_lines(width, height, 135, spacing)[::2]:
+        for line2 in lattice_lines(width, height, 45, spacing)[::2]:
+            intersection = find_intersection(line1, line2)
+            if intersection:
+                expected.append(intersection)
+    assert np.array_equal(lattice_intersections(width, height, spacing), np.array(expected).reshape(-1, 2))
+
+
+def brute_force(first, second, eps=1e-9):
+    points, pairs = [], []
+    for i, (x1, y1, x2, y2) in enumerate(first):
+        for j, (x3, y3, x4, y4) in enumerate(second):
+            r, s, qp = np.array([x2 - x1, y2 - y1]), np.array([x4 - x3, y4 - y3]), np.array([x3 - x1, y3 - y1])
+            denominator = r[0] * s[1] - r[1] * s[0]
+            if denominator == 0:
+                continue
+            t = (qp[0] * s[1] - qp[1] * s[0]) / denominator
+            u = (qp[0] * r[1] - qp[1] * r[0]) / denominator
+            if -eps <= t <= 1 + eps and -eps <= u <= 1 + eps:
+                points.append((x1, y1) + t * r)
+                pairs.append((i, j))
+    return np.array(points).reshape(-1, 2), np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
+
+def check(first, second, **kwargs):
+    points, i, j = segment_intersections(first, second, **kwargs)
+    expected_points, expected_pairs = brute_force(first, second)
+    assert np.array_equal(np.stack([i, j], axis=1), expected_pairs)
+    assert np.allclose(points, expected_points)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_segment_intersections_match_brute_force(seed):
+    """短线段中混有贯穿全图的长对角线"""
+    rng = np.random.default_rng(seed)
+    start = rng.uniform(0, 500, (150, 2))
+    short = np.hstack([start, start + rng.normal(0, 15, (150, 2))])
+    long = rng.uniform(0, 500, (6, 4))
+    first, second = np.vstack([short[:80], long[:3]]), np.vstack([short[80:], long[3:]])
+    check(first, second)
+    check(first, second, cell_size=7.0)
+
+
+def test_segment_intersections_on_grid_corners():
+    """线段恰好穿过单元角点、沿网格线或端点相接，交点只落在相邻单元的边界上"""
+    first = np.array([(0, 0, 40, 40), (0, 20, 40, 20), (10, 0, 10, 40), (30, 10, 20, 20)], dtype=float)
+    second = np.array([(0, 40, 40, 0), (20, 0, 20, 40), (20, 20, 30, 30), (40, 10, 30, 10)], dtype=float)
+    check(first, second, cell_size=10.0)
+    check(first, second, cell_size=20.0)
+
+
+def test_segment_intersections_empty():
+    points, i, j = segment_intersections(np.empty((0, 4)), [(0, 0, 1, 1)])
+    assert points.shape == (0, 2) and i.size == j.size == 0
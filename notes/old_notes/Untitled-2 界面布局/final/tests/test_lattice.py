@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from generate_npy import DashedLattice, draw_watermark_lines
+
+COLOR = (200, 200, 200, 255)
+SHADOW_COLOR = (200, 200, 200, 128)
+BACKGROUND = (255, 255, 255, 0)
+
+
+def reference(width, height, spacing, dash_length, line_width):
+    image = Image.new("RGBA", (width, height), BACKGROUND)
+    for angle in (45, 135):
+        draw_watermark_lines(image, angle, COLOR, SHADOW_COLOR, dash_length=dash_length, line_width=line_width,
+                             spacing=spacing)
+    return np.array(image)
+
+
+@pytest.mark.parametrize("line_width", range(1, 9))
+@pytest.mark.parametrize("width, height, spacing, dash_length", [(240, 160, 37, 13), (173, 211, 41, 9)])
+def test_dashed_lattice_matches_draw_watermark_lines(width, height, spacing, dash_length, line_width):
+    """精确模式与逐段 draw.line 逐像素一致，包括线段跨出画布左右边缘的位置"""
+    expected = reference(width, height, spacing, dash_length, line_width)
+    lattice = DashedLattice(width, height, spacing, COLOR, SHADOW_COLOR, dash_length=dash_length,
+                            line_width=line_width, background=BACKGROUND)
+    rendered = lattice.render()
+    assert np.array_equal(rendered, expected)
+    assert np.array_equal(rendered[..., 3] != 0, expected[..., 3] != 0)
+    # 按行条带渲染再拼接，结果与整幅相同
+    strips = [lattice.render(top, min(top + 50, height)) for top in range(0, height, 50)]
+    assert np.array_equal(np.concatenate(strips), expected)
@@ -0,0 +1,27 @@
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from generate_npy import STAMP_ATLAS_SIZE, draw_stamps, get_stamp_mask
+
+SHADOW_COLOR = (200, 200, 200, 128)
+
+
+def test_draw_stamps_matches_draw_text():
+    font = ImageFont.load_default(30)
+    positions = [(10.5, 12.25), (60.0, 40.75), (-3.5, 20.5), (90.25, -4.0)]
+    passes = [((2, 2), SHADOW_COLOR), ((-2, -2), SHADOW_COLOR), ((0, 0), (200, 200, 200, 255))]
+    expected = Image.new("RGBA", (160, 90), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(expected)
+    for x, y in positions:
+        for (dx, dy), fill in passes:
+            draw.text((x + dx, y + dy), "BH", font=font, fill=fill)
+    stamped = Image.new("RGBA", (160, 90), (255, 255, 255, 0))
+    draw_stamps(stamped, "BH", font, positions, passes)
+    assert np.array_equal(np.array(stamped), np.array(expected))
+
+
+def test_stamp_atlas_is_bounded():
+    font = ImageFont.load_default(12)
+    for index in range(STAMP_ATLAS_SIZE + 20):
+        get_stamp_mask(str(index), font, (0.0, 0.0))
+    assert get_stamp_mask.cache_info().currsize <= STAMP_ATLAS_SIZE
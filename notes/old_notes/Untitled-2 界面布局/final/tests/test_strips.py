@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+
+from generate_npy import iter_watermark_strips, render_watermark
+
+
+@pytest.mark.parametrize("strip_rows", [37, 100, 128])
+@pytest.mark.parametrize("antialias", [False, True])
+def test_strips_concatenate_to_full_render(arial, strip_rows, antialias):
+    """条带高度不整除图片高度时，逐条带拼接的结果与整幅生成逐像素一致"""
+    config = {'spacing': 40, 'opacity': 100, 'shadow_opacity': 60, 'line_width': 6, 'foggy_line_width': 0,
+              'dash_length': 13, 'antialias': antialias}
+    width, height = 230, 301
+    expected = np.array(render_watermark(config, width, height, config['dash_length']))
+    strips = list(iter_watermark_strips(config, width, height, config['dash_length'], strip_rows=strip_rows))
+    assert [top for top, _ in strips] == list(range(0, height, strip_rows))
+    assert np.array_equal(np.concatenate([np.array(strip) for _, strip in strips]), expected)
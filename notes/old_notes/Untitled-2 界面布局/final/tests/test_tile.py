@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+from basic import tile_watermark
+from generate_npy import render_watermark, render_watermark_tile
+
+
+@pytest.mark.parametrize("spacing, line_width", [(37, 4), (40, 6), (50, 3)])
+def test_tile_wrap_matches_full_render(arial, spacing, line_width):
+    """瓦片按 np.take 的 wrap 模式平铺，与 snap_dash_period 线长下的整幅生成一致（边缘截断处除外）"""
+    config = {'spacing': spacing, 'opacity': 100, 'shadow_opacity': 60, 'line_width': line_width,
+              'foggy_line_width': 0, 'dash_length': 13}
+    tile, dash_length, gap_length = render_watermark_tile(config)
+    assert tile.shape == (2 * spacing, 2 * spacing, 4)
+    width, height = 5 * spacing + 17, 6 * spacing
+    full = np.array(render_watermark(config, width, height, dash_length, gap_length))
+    wrapped = tile_watermark(tile, width, height)
+    # 整幅图的边缘处线段被截断，比较阴影线宽以外的区域
+    margin = line_width + 12
+    assert np.array_equal(wrapped[margin:-margin, margin:-margin], full[margin:-margin, margin:-margin])
@@ -17,6 +17,18 @@ class ConfigLoader:
                 return []
         return config.get("watermark_types", [])
 
+    @staticmethod
+    def load_engine_config():
+        """读取批处理引擎配置（config.yaml 中的 watermark 段）"""
+        config_path = Path(__file__).parent / "config.yaml"
+        with open(config_path, "r", encoding="utf-8") as f:
+            try:
+                config = yaml.safe_load(f)
+            except Exception as e:
+                logger.exception(e)
+                return {}
+        return config.get("watermark", {})
+
 def setup_logging():
     logging.basicConfig(
         level=logging.WARNING,
@@ -1,10 +1,15 @@
-from pydantic import validate_arguments
+import logging
+import os
 from functools import wraps
 from config import ConfigLoader
+from utils.basic import iter_watermark
+logger = logging.getLogger(__name__)
 
 class WatermarkModel:
     def __init__(self):
         self.config = ConfigLoader.load_watermark_config()
+        # 最近一次 process_files 中每张图片的整帧分配次数
+        self.last_allocations = {}
         self._build_handlers()
 
     def get_watermark_config(self):
@@ -13,8 +18,15 @@ class WatermarkModel:
     def get_handler(self, wm_type):
         return getattr(self, self.config[wm_type]['handler'])
 
-    def process_normal_watermark(self, folder,  **kwargs):
-        print({"folder":folder,**{param: data for param, data in kwargs.items()}})
+    def process_normal_watermark(self, folder, **kwargs):
+        """正常水印：交给批处理引擎，返回处理成功的文件名列表"""
+        return list(self.process_files(folder, 'normal', kwargs.get('default_opacity'),
+                                       formats=kwargs.get('allowed_formats')))
+
+    def process_adaptive_watermark(self, folder, **kwargs):
+        """自适应亮度水印：与正常水印共用模板，混合模式取配置中的 adaptive"""
+        return list(self.process_files(folder, 'adaptive', kwargs.get('default_opacity'),
+                                       formats=kwargs.get('allowed_formats')))
 
     def process_foggy_watermark(self, folder, text="BH", **kwargs):
         print({"folder":folder,**{param: data for param, data in kwargs.items()}})
@@ -26,24 +38,50 @@ class WatermarkModel:
     def load_watermark_config(self):
         return self.config
 
+    def process_files(self, folder, watermark_type, opacity=None, chunksize=None, dynamic_text=None, formats=None):
+        """流式处理文件夹中的图片，每完成一张就返回其文件名
+
+        opacity 为空时使用该水印类型 params.default_opacity 的默认值；
+        dynamic_text 为逐图文字的格式串（如 "{stem}"），为空时使用引擎配置中的 dynamic_text；
+        formats 为要处理的图片格式（如处理方法传入的 allowed_formats），为空时处理全部支持的格式；
+        每张图片的整帧分配次数（ImageResult.allocations）按文件名记录在 last_allocations 中
+        """
+        engine_config = ConfigLoader.load_engine_config()
+        # 既支持配置中的水印类型名，也支持直接传入 npy 模板名
+        type_config = self.config.get(watermark_type, {})
+        npy_path = type_config.get('npy_path', watermark_type)
+        if opacity is None:
+            opacity = type_config.get('params', {}).get('default_opacity', {}).get('default')
+        quality = engine_config.get('quality', 30)
+        self.last_allocations = {}
+        for result in iter_watermark(folder, npy_path, opacity, quality,
+                                     config=engine_config, chunksize=chunksize,
+                                     blend_mode=type_config.get('blend_mode'), dynamic_text=dynamic_text,
+                                     formats=formats):
+            if result.error:
+                logger.error(f"处理失败 {result.input_path}: {result.error}")
+                continue
+            name = os.path.basename(result.input_path)
+            self.last_allocations[name] = result.allocations
+            logger.debug(f"{name} 整帧分配 {result.allocations} 次")
+            yield name
+
 
     def _build_handlers(self):
 
         """动态创建带验证的处理方法"""
+        # 每个处理方法只包装一次：多个水印类型共用同一个 handler 时，
+        # 重复 setattr 会把上一次的包装再包一层，参数被清洗两遍（list[str] 会被再次 split）
+        wrapped = {}
         for wm_type in self.config:
             handler_name = self.config[wm_type]['handler']
+            if handler_name in wrapped:
+                # 共用处理方法时按首个水印类型的参数规则校验
+                logger.warning(f"水印类型 {wm_type} 与 {wrapped[handler_name]} 共用处理方法 {handler_name}")
+                continue
             original_method = getattr(self, handler_name)
 
-            # 生成参数约束规则
-            param_rules = {
-                param: {'type': info['type'], **info.get('validations', {})}
-                for param, info in self.config[wm_type]['params'].items()
-            }
-
-            # 立即绑定当前作用域的wm_type
-            current_type = wm_type  # 创建局部变量副本
-
-            # 使用闭包工厂函数
+            # 使用闭包工厂函数，立即绑定当前作用域的 wm_type
             def create_validator(wm_type, original_method):
                 @wraps(original_method)
                 def wrapper(folder, *args, **kwargs):
@@ -52,9 +90,8 @@ class WatermarkModel:
 
                 return wrapper
 
-            wrapper = create_validator(wm_type, original_method)
-
-            setattr(self, handler_name, wrapper)
+            setattr(self, handler_name, create_validator(wm_type, original_method))
+            wrapped[handler_name] = wm_type
 
     def _sanitize_params(self, wm_type, raw_params):
         """参数清洗与验证"""
@@ -1,5 +1,5 @@
 from PySide6.QtCore import QObject, Qt
-from typing import Dict, Any, Callable
+from typing import Dict, Any, Callable, Optional
 from functools import lru_cache
 import logging
 logger = logging.getLogger(__name__)
@@ -98,14 +98,16 @@ class MainPresenter(QObject):
         print("未知选项，使用默认处理")
 
     @lru_cache(maxsize=32)
-    def _parse_opacity(self, raw_value: str) -> int:
-        return int(raw_value) if raw_value.isdigit() else 50
+    def _parse_opacity(self, raw_value: str) -> Optional[int]:
+        # 未填写时返回 None，由模型使用水印类型的 default_opacity
+        return int(raw_value) if raw_value.isdigit() else None
 
     def handle_generate(self, index, watermark_type):
         folder = self.view.folder_input.text()
         opacity = self._parse_opacity(self.view.opacity_input.text())
         try:
-            self._validate_opacity(int(opacity))
+            if opacity is not None:
+                self._validate_opacity(int(opacity))
         except ValueError as e:
             self.view.show_error(str(e))
             logger.error(e)
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+from PIL import ImageFont
+
+# 测试按 main.py 的方式以项目根目录为导入根（from utils.xxx import ...）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def font_path(tmp_path_factory):
+    """文字水印用的字体文件：不依赖系统字体，把 Pillow 内置的默认字体写成 .ttf"""
+    font = ImageFont.load_default(30)
+    path = tmp_path_factory.mktemp("fonts") / "default.ttf"
+    path.write_bytes(font.path.getvalue())
+    return str(path)
@@ -0,0 +1,91 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from models import watermark_model
+from models.watermark_model import WatermarkModel
+from utils.basic import ImageResult, process_single_image
+from utils.buffers import BufferPool
+from utils.composite import composite_over, prepare_template
+
+
+@pytest.mark.parametrize("mode, suffix, draft", [("RGB", "jpg", None), ("RGB", "jpg", "YCbCr"), ("L", "png", None),
+                                                 ("RGBA", "png", None)])
+def test_decode_into_pool_matches_load(tmp_path, mode, suffix, draft):
+    """解码到池内画布与普通解码逐像素一致；同尺寸的第二张图复用画布，不再分配"""
+    rng = np.random.default_rng(0)
+    pool = BufferPool()
+    for n in range(2):
+        path = tmp_path / f"{n}.{suffix}"
+        Image.fromarray(rng.integers(0, 256, (90, 120, len(mode)), dtype=np.uint8).squeeze(), mode).save(path)
+        with Image.open(path) as expected, Image.open(path) as image:
+            if draft:
+                expected.draft(draft, None)
+                image.draft(draft, None)
+            before = pool.allocations
+            decoded = pool.decode(image, "canvas")
+            assert decoded.mode == expected.mode
+            np.testing.assert_array_equal(pool.pixels(decoded), np.asarray(expected).reshape(pool.pixels(decoded).shape))
+        if n:
+            assert pool.allocations == before
+
+
+def test_sparse_composite_on_pooled_pixels():
+    """稀疏叠加可以直接写入池内 RGB 画布（每像素 4 字节的通道切片）"""
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 256, (150, 200, 3), dtype=np.uint8)
+    rgba = rng.integers(0, 256, (150, 200, 4), dtype=np.uint8)
+    rgba[..., 3] *= rng.random((150, 200)) < 0.05
+    template = prepare_template(rgba, 3)
+    assert template.index is not None
+    pool = BufferPool()
+    canvas = pool.image("canvas", "RGB", (200, 150))
+    canvas.paste(Image.fromarray(base))
+    composite_over(pool.pixels(canvas), template, pool)
+    np.testing.assert_array_equal(np.asarray(canvas), composite_over(base.copy(), template))
+
+
+@pytest.mark.parametrize("style", [None, "tiled"])
+def test_process_single_image_counts_real_allocations(tmp_path, font_path, style):
+    """稳定状态下计数与 PIL 实际新建的图像块数一致，numpy 侧不再分配整帧；输出与不用缓冲池时一致"""
+    rng = np.random.default_rng(0)
+    template = rng.integers(0, 256, (600, 800, 4), dtype=np.uint8)
+    config = {'output_height': 450}
+    if style:
+        config.update(dynamic_text='{stem}', dynamic_text_font=font_path, dynamic_text_style=style)
+    pool = BufferPool()
+    for n in range(3):
+        path = tmp_path / f"IMG_{n}.jpg"
+        Image.fromarray(rng.integers(0, 256, (600, 800, 3), dtype=np.uint8)).save(path)
+        pooled, plain = tmp_path / f"pooled_{n}.jpg", tmp_path / f"plain_{n}.jpg"
+        blocks = Image.core.get_stats()["allocated_blocks"]
+        tracemalloc.start()
+        allocations = process_single_image(str(path), str(pooled), config, template, 90, "t", pool)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        blocks = Image.core.get_stats()["allocated_blocks"] - blocks
+        process_single_image(str(path), str(plain), config, template, 90, "t")
+        with Image.open(pooled) as a, Image.open(plain) as b:
+            np.testing.assert_array_equal(np.asarray(a), np.asarray(b))
+        if n:
+            if style is None:
+                assert allocations == blocks
+                assert peak < 600 * 450 * 3
+            else:
+                # 缩放输出与其中间结果，加上亮度采样的灰度图（PIL 转换与 numpy 复制）；
+                # 印章叠加的工作区按 STAMP_CHUNK_PIXELS 分块，不随图片面积增长，这里不比较峰值
+                assert allocations == 2 + 2
+
+
+def test_process_files_keeps_allocations(monkeypatch):
+    def fake_iter_watermark(folder, *args, **kwargs):
+        yield ImageResult('in/a.jpg', 'out/a.jpg', allocations=2)
+        yield ImageResult('in/b.jpg', 'out/b.jpg', error='broken')
+        yield ImageResult('in/c.jpg', 'out/c.jpg', allocations=0)
+
+    monkeypatch.setattr(watermark_model, 'iter_watermark', fake_iter_watermark)
+    model = WatermarkModel()
+    assert list(model.process_files('in', 'normal')) == ['a.jpg', 'c.jpg']
+    assert model.last_allocations == {'a.jpg': 2, 'c.jpg': 0}
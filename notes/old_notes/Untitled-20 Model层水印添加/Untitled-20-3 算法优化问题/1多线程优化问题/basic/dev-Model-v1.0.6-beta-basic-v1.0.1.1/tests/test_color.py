@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from utils.color import adjust_to_target_luminance, luminance
+
+
+def test_palette_reaches_target_luminance():
+    rng = np.random.default_rng(0)
+    palette = rng.integers(0, 256, (500, 3), dtype=np.uint8)
+    target = rng.uniform(0, 1, 500)
+    adjusted, t = adjust_to_target_luminance(palette, target)
+    assert adjusted.shape == (500, 3) and adjusted.dtype == np.uint8 and t.shape == (500,)
+    reached = luminance(palette) >= target
+    # 已达标的颜色不变
+    assert np.all(t[reached] == 0) and np.array_equal(adjusted[reached], palette[reached])
+    # 其余颜色的亮度落在目标附近（误差来自二分容差与取整到 uint8）
+    assert np.abs(luminance(adjusted[~reached]) - target[~reached]).max() < 5e-3
+    assert np.all((t >= 0) & (t <= 1))
+
+
+@pytest.mark.parametrize("target", [0.0, 0.05, 0.5, 1.0])
+def test_black_and_white(target):
+    palette = np.array([[0, 0, 0], [255, 255, 255]], dtype=np.uint8)
+    adjusted, t = adjust_to_target_luminance(palette, target)
+    # 白色已是最大亮度，始终不变；黑色向白色混合到目标亮度
+    assert t[1] == 0 and np.array_equal(adjusted[1], (255, 255, 255))
+    assert abs(luminance(adjusted[0]) - target) < 5e-3
+    assert (t[0] == 0) == (target == 0)
+
+
+def test_unreachable_target_saturates_to_white():
+    adjusted, t = adjust_to_target_luminance(np.array([[10, 20, 30]], dtype=np.uint8), 1.5)
+    assert t[0] == 1 and np.array_equal(adjusted[0], (255, 255, 255))
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.color import contrast_ratio, contrast_target_luminance
+from utils.composite import ADAPTIVE_CONTRAST, BLEND_MODES, composite_over, prepare_template
+
+
+def _random_template(rng, height, width, coverage):
+    rgba = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    rgba[..., 3] *= rng.random((height, width)) < coverage
+    return rgba
+
+
+def _paste(base, rgba):
+    """参考结果：PIL 的 Image.paste(wm, (0, 0), wm)"""
+    image = Image.fromarray(base)
+    watermark = Image.fromarray(rgba, "RGBA")
+    image.paste(watermark, (0, 0), watermark)
+    return np.asarray(image)
+
+
+@pytest.mark.parametrize("channels", [3, 4])
+@pytest.mark.parametrize("sparse,coverage", [(False, 0.5), (True, 0.05)])
+@pytest.mark.parametrize("template_size", [(150, 200), (90, 120), (200, 260)])
+def test_normal_matches_paste(channels, sparse, coverage, template_size):
+    """normal 模式（稠密与稀疏两条路径）与 paste 逐字节一致，模板比底图大或小都只影响重叠区域"""
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 256, (150, 200, channels), dtype=np.uint8)
+    rgba = _random_template(rng, *template_size, coverage)
+    template = prepare_template(rgba[:150, :200], channels, sparse=sparse)
+    assert (template.index is not None) == sparse
+
+    result = composite_over(base.copy(), template)
+    height, width = min(150, template_size[0]), min(200, template_size[1])
+    expected = base.copy()
+    expected[:height, :width] = _paste(base[:height, :width], rgba[:height, :width])
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_batch_matches_single():
+    """(N, H, W, C) 批量叠加与逐张叠加一致"""
+    rng = np.random.default_rng(1)
+    stack = rng.integers(0, 256, (3, 70, 90, 3), dtype=np.uint8)
+    template = prepare_template(_random_template(rng, 70, 90, 0.4), 3, "multiply")
+    expected = np.stack([composite_over(image.copy(), template) for image in stack])
+    np.testing.assert_array_equal(composite_over(stack.copy(), template), expected)
+
+
+def _float_blend(mode, d, s):
+    d, s = d / 255.0, s / 255.0
+    if mode == "multiply":
+        b = d * s
+    elif mode == "screen":
+        b = d + s - d * s
+    elif mode == "overlay":
+        b = np.where(d < 0.5, 2 * d * s, 1 - 2 * (1 - d) * (1 - s))
+    else:
+        b = (1 - 2 * s) * d * d + 2 * s * d
+    return b * 255
+
+
+@pytest.mark.parametrize("mode", ["multiply", "screen", "overlay", "soft_light"])
+@pytest.mark.parametrize("sparse", [False, True])
+def test_blend_modes_match_float_formula(mode, sparse):
+    """定点混合内核与浮点公式 out = d + (B(d, s) - d) * a 的误差不超过 2"""
+    rng = np.random.default_rng(2)
+    base = rng.integers(0, 256, (64, 96, 3), dtype=np.uint8)
+    rgba = _random_template(rng, 64, 96, 0.1 if sparse else 0.6)
+    result = composite_over(base.copy(), prepare_template(rgba, 3, mode, sparse=sparse)).astype(float)
+
+    d, s, a = base.astype(float), rgba[..., :3].astype(float), rgba[..., 3:].astype(float) / 255
+    expected = d + (_float_blend(mode, d, s) - d) * a
+    assert np.abs(result - expected).max() <= 2
+
+
+def test_unknown_blend_mode_rejected():
+    with pytest.raises(ValueError):
+        prepare_template(np.zeros((4, 4, 4), dtype=np.uint8), 3, "no_such_mode")
+    assert "adaptive" in BLEND_MODES
+
+
+def test_adaptive_target_reaches_contrast():
+    """自适应模式的目标亮度与底图的对比度达到 ADAPTIVE_CONTRAST：暗底图提亮，亮底图压暗"""
+    level = np.linspace(0, 1, 1001)
+    target = contrast_target_luminance(level, ADAPTIVE_CONTRAST)
+    assert np.all((target >= 0) & (target <= 1))
+    assert np.allclose(contrast_ratio(level, target), ADAPTIVE_CONTRAST)
+    assert np.all(target[level < 0.1] > level[level < 0.1])
+    assert np.all(target[level > 0.3] < level[level > 0.3])
+
+
+def _adaptive_over(color, base_value):
+    rgba = np.full((8, 8, 4), (color, color, color, 255), dtype=np.uint8)
+    base = np.full((8, 8, 3), base_value, dtype=np.uint8)
+    return composite_over(base, prepare_template(rgba, 3, "adaptive"))[0, 0, 0]
+
+
+def test_adaptive_pushes_towards_contrast_only():
+    """对比度不足的水印在黑底上被提亮、在白底上被压暗，已经足够醒目的水印保持原色"""
+    assert _adaptive_over(40, 0) > 40
+    assert _adaptive_over(230, 255) < 230
+    assert _adaptive_over(128, 0) == 128
+    assert _adaptive_over(128, 255) == 128
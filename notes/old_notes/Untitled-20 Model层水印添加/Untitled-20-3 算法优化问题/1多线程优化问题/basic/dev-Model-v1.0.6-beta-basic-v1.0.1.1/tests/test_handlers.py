@@ -0,0 +1,78 @@
+import pytest
+
+from models.watermark_model import WatermarkModel
+
+
+class RecordingModel(WatermarkModel):
+    """把处理方法换成记录调用参数，只检查 _build_handlers 的包装与参数清洗"""
+
+    def __init__(self):
+        self.calls = []
+        super().__init__()
+
+    def process_normal_watermark(self, folder, **kwargs):
+        self.calls.append(('normal', folder, kwargs))
+
+    def process_adaptive_watermark(self, folder, **kwargs):
+        self.calls.append(('adaptive', folder, kwargs))
+
+    def process_foggy_watermark(self, folder, **kwargs):
+        self.calls.append(('foggy', folder, kwargs))
+
+
+@pytest.fixture
+def model():
+    return RecordingModel()
+
+
+def test_every_type_has_a_handler(model):
+    for wm_type in model.config:
+        assert callable(model.get_handler(wm_type))
+
+
+def test_list_param_is_sanitized_once(model):
+    # 同一处理方法被包装两次时，第二层会把 ['jpg'] 当作字符串再 split 一遍
+    model.get_handler('normal')('', default_opacity=50)
+    assert model.calls == [('normal', '', {'default_opacity': 50, 'allowed_formats': ['jpg']})]
+
+
+def test_adaptive_has_its_own_handler(model):
+    model.get_handler('adaptive')('in', allowed_formats='jpg,png')
+    assert model.calls == [('adaptive', 'in', {'default_opacity': 75, 'allowed_formats': ['jpg', 'png']})]
+
+
+def test_handler_names_are_wrapped_once(model):
+    # 每个处理方法只有一层包装：__wrapped__ 直接指向原始方法
+    for wm_type in model.config:
+        handler = model.get_handler(wm_type)
+        assert not hasattr(handler.__wrapped__, '__wrapped__')
+
+
+@pytest.mark.parametrize('params', [
+    {'default_opacity': 101},
+    {'default_opacity': -1},
+    {'allowed_formats': 'gif'},
+])
+def test_invalid_params_raise(model, params):
+    with pytest.raises(ValueError):
+        model.get_handler('normal')('', **params)
+    assert model.calls == []
+
+
+class RoutingModel(WatermarkModel):
+    """只替换批处理引擎，检查处理方法把清洗后的参数交给 process_files"""
+
+    def __init__(self):
+        self.runs = []
+        super().__init__()
+
+    def process_files(self, folder, watermark_type, opacity=None, chunksize=None, dynamic_text=None, formats=None):
+        self.runs.append((folder, watermark_type, opacity, formats))
+        yield 'a.jpg'
+
+
+@pytest.mark.parametrize('wm_type', ['normal', 'adaptive'])
+def test_handlers_route_to_engine(wm_type):
+    model = RoutingModel()
+    assert model.get_handler(wm_type)('in', default_opacity='40', allowed_formats='PNG, jpg') == ['a.jpg']
+    assert model.runs == [('in', wm_type, 40, ['PNG', 'jpg'])]
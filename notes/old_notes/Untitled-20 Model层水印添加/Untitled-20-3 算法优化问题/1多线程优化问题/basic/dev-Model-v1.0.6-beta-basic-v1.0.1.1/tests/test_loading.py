@@ -0,0 +1,113 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import numpy as np
+import pytest
+from PIL import Image, ImageOps
+
+from utils.basic import load_scaled_image, _raw_row_reader, _reduce_for, _resize_in_bands
+
+
+def _gradient(width, height):
+    x = np.linspace(0, 255, width)[None, :]
+    y = np.linspace(0, 255, height)[:, None]
+    return np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1).astype(np.uint8)
+
+
+@pytest.mark.parametrize("tiled_pixels", [0, 1])
+@pytest.mark.parametrize("mode", ["I;16", "I;16B", "P", "1", "LA", "RGBA", "I", "F"])
+def test_load_scaled_image_any_mode(tmp_path, mode, tiled_pixels):
+    """reduce 不支持的模式（16 位灰度、调色板、二值）回退到 resize，不抛异常"""
+    image = Image.fromarray(_gradient(400, 300)).convert("RGBA")
+    if mode in ("I;16", "I;16B"):
+        image = Image.fromarray((_gradient(400, 300)[..., 0].astype(np.uint16) * 257)).convert(mode)
+    else:
+        image = image.convert(mode)
+    path = tmp_path / ("input.tiff" if mode in ("I;16B", "F", "I") else "input.png")
+    image.save(path)
+
+    result = load_scaled_image(str(path), 100, tiled_pixels=tiled_pixels)
+    assert result.size == (133, 100)
+
+
+def test_reduce_skips_palette_with_alpha():
+    """PA 的像素值是调色板下标，取平均没有意义，不做 reduce"""
+    image = Image.new("PA", (400, 300))
+    assert _reduce_for(image, (100, 75)) is image
+    assert _reduce_for(Image.new("LA", (400, 300)), (100, 75)).size == (100, 75)
+
+
+@pytest.mark.parametrize("tiled_pixels", [0, 1])
+def test_load_scaled_image_matches_direct_resize(tmp_path, tiled_pixels):
+    """reduce + resize 与直接 resize 的结果只有插值上的细小差别"""
+    pixels = _gradient(1200, 900)
+    Image.fromarray(pixels).save(tmp_path / "input.png")
+
+    result = np.asarray(load_scaled_image(str(tmp_path / "input.png"), 200, tiled_pixels=tiled_pixels), dtype=int)
+    expected = np.asarray(Image.fromarray(pixels).resize((266, 200)), dtype=int)
+    assert result.shape == expected.shape
+    assert np.abs(result - expected).max() <= 2
+
+
+@pytest.mark.parametrize("tiled_pixels", [0, 1])
+def test_load_scaled_image_applies_exif_orientation(tmp_path, tiled_pixels):
+    """EXIF 方向在缩小之后应用，目标高度按摆正后的方向计算"""
+    image = Image.fromarray(_gradient(800, 400))
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    path = tmp_path / "input.jpg"
+    image.save(path, exif=exif, quality=95)
+
+    result = load_scaled_image(str(path), 200, tiled_pixels=tiled_pixels)
+    with Image.open(path) as original:
+        expected = ImageOps.exif_transpose(original).resize(result.size)
+    assert result.size == (100, 200)
+    assert np.abs(np.asarray(result, dtype=int) - np.asarray(expected, dtype=int)).mean() < 4
+
+
+@pytest.mark.parametrize("suffix, raw", [("bmp", True), ("ppm", True), ("tiff", True), ("png", False)])
+@pytest.mark.parametrize("spill_bytes", [1, 1 << 30])
+def test_resize_in_bands_matches_resize(tmp_path, suffix, raw, spill_bytes):
+    """按条带解码缩放（raw 编码按行解码，其余整张解码，可落盘）与整图缩放逐像素一致"""
+    rng = np.random.default_rng(0)
+    path = tmp_path / f"input.{suffix}"
+    Image.fromarray(rng.integers(0, 256, (1237, 1651, 3), dtype=np.uint8)).save(path)
+    with Image.open(path) as image, Image.open(path) as expected:
+        assert (_raw_row_reader(image) is not None) == raw
+        result = _resize_in_bands(image, (331, 248), spill_bytes)
+        np.testing.assert_array_equal(np.asarray(result), np.asarray(expected.resize((331, 248))))
+
+
+def test_tiled_load_peak_memory_is_bounded(tmp_path):
+    """超大 raw 图片按条带解码：子进程中加载的峰值内存（RSS 与 tracemalloc）只有条带大小，远小于整帧"""
+    if not os.path.exists("/proc/self/status"):
+        pytest.skip("需要 /proc/self/status 中的 VmHWM")
+    width, height, band_bytes = 4000, 3000, 4 * 1024 * 1024
+    path = tmp_path / "large.bmp"
+    rows = np.linspace(0, 255, width, dtype=np.uint8)[None, :, None]
+    Image.fromarray(np.broadcast_to(rows, (height, width, 3)).copy()).save(path)
+    script = textwrap.dedent(f"""
+        import sys, tracemalloc
+        sys.path.insert(0, {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))!r})
+        import utils.basic
+
+        def peak_rss():
+            # 本进程的 RSS 峰值（ru_maxrss 在 vfork 启动的子进程中会带上父进程的峰值）
+            with open("/proc/self/status") as status:
+                return next(int(line.split()[1]) * 1024 for line in status if line.startswith("VmHWM:"))
+
+        utils.basic._RESIZE_BAND_BYTES = {band_bytes}
+        before = peak_rss()
+        tracemalloc.start()
+        image = utils.basic.load_scaled_image({str(path)!r}, 300, tiled_pixels=1)
+        peak = tracemalloc.get_traced_memory()[1]
+        print(*image.size, peak_rss() - before, peak)
+    """)
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+    result_width, result_height, rss, peak = map(int, output.split())
+    assert (result_width, result_height) == (400, 300)
+    # 整帧解码需要 width * height * 4 字节（PIL 的 RGB 每像素 4 字节）
+    assert rss < width * height * 4 // 4
+    assert peak < 2 * band_bytes
@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.basic import iter_watermark
+
+
+@pytest.fixture
+def batch(tmp_path):
+    """三张小图与一张 RGBA 模板（模板路径不含扩展名，与 resolve_template_path 的约定一致）"""
+    rng = np.random.default_rng(0)
+    folder = tmp_path / "input"
+    folder.mkdir()
+    for n in range(3):
+        Image.fromarray(rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)).save(folder / f"IMG_{n}.jpg")
+    template = rng.integers(0, 256, (300, 300, 4), dtype=np.uint8)
+    np.save(tmp_path / "template.npy", template)
+    return str(folder), str(tmp_path / "template")
+
+
+@pytest.mark.parametrize("batch_mode", [False, True])
+def test_iter_watermark_with_dynamic_text(batch, font_path, batch_mode):
+    folder, template = batch
+    config = {'output_height': 100, 'template_share': 'mmap', 'batch_mode': batch_mode,
+              'dynamic_text': '{index:02d} {stem}', 'dynamic_text_font': font_path, 'dynamic_text_size': 16}
+    results = list(iter_watermark(folder, template, 80, 90, config=config, processes=1))
+    assert sorted(os.path.basename(r.input_path) for r in results) == ['IMG_0.jpg', 'IMG_1.jpg', 'IMG_2.jpg']
+    assert all(r.error is None for r in results)
+    for r in results:
+        with Image.open(r.output_path) as output:
+            assert output.height == 100
+
+
+def test_iter_watermark_filters_formats(batch):
+    folder, template = batch
+    Image.new("RGB", (160, 120), (90, 90, 90)).save(os.path.join(folder, "extra.png"))
+    config = {'output_height': 100, 'template_share': 'mmap'}
+    results = list(iter_watermark(folder, template, 80, 90, config=config, processes=1, formats=['PNG']))
+    assert [os.path.basename(r.input_path) for r in results] == ['extra.png']
+    with pytest.raises(ValueError):
+        next(iter_watermark(folder, template, 80, 90, config=config, processes=1, formats=['gif']))
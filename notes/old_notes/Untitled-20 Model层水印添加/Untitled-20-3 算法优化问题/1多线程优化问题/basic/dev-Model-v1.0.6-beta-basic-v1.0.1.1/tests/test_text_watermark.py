@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.basic import add_dynamic_text, dynamic_text_seed, format_dynamic_text, iter_watermark
+from utils.text_watermark import (TEXT_STYLES, BrightnessSampler, overlap_layers, scattered_positions, stamp_sprite,
+                                  stamp_text)
+
+
+def test_brightness_sampler_matches_crop_mean():
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (120, 160, 3), dtype=np.uint8))
+    boxes = np.array([(0, 0, 30, 20), (100, 90, 60, 40), (-10, -5, 25, 15), (150, 110, 30, 30)])
+    x, y, w, h = boxes.T
+    expected = [np.asarray(image.crop((bx, by, bx + bw, by + bh)).convert("L")).mean() for bx, by, bw, bh in boxes]
+    assert np.allclose(BrightnessSampler(image).mean(x, y, w, h), expected)
+
+
+@pytest.mark.parametrize("base_value, text_value", [(0, 255), (255, 0)])
+def test_auto_color_contrasts_with_base(font_path, base_value, text_value):
+    image = Image.new("RGB", (200, 100), (base_value,) * 3)
+    stamped = np.asarray(stamp_text(image, "Ab", font_path, 30, "auto", "center", 0))
+    # 文字取与底图相反的颜色：字形内部的像素恰为 text_value，边缘为抗锯齿的中间值
+    assert np.any(np.all(stamped == text_value, axis=-1))
+
+
+@pytest.mark.parametrize("style", TEXT_STYLES)
+@pytest.mark.parametrize("mode", ["RGB", "YCbCr", "L", "P"])
+def test_dynamic_text_styles(font_path, style, mode):
+    """各排布方式都能叠加到输出图片上；暗底图上为白色文字（YCbCr 下同样是白色，而不是按 RGB 数值写入）"""
+    image = Image.new("RGB", (400, 300), (30, 30, 30)).convert(mode)
+    config = {'dynamic_text': '{stem}', 'dynamic_text_font': font_path, 'dynamic_text_size': 24,
+              'dynamic_text_style': style, 'dynamic_text_color': 'auto'}
+    stamped = np.asarray(add_dynamic_text(image.copy(), 'input/IMG_1.jpg', config).convert("RGB"))
+    assert np.any(np.all(stamped >= 250, axis=-1))
+
+
+def test_unknown_text_style_rejected_before_dispatch(tmp_path):
+    config = {'dynamic_text': '{stem}', 'dynamic_text_style': 'diagonal'}
+    with pytest.raises(ValueError):
+        next(iter_watermark(str(tmp_path), 'missing_template', None, 30, config=config))
+    assert not (tmp_path / 'output').exists()
+
+
+def test_dynamic_text_index_field():
+    assert format_dynamic_text('{index:04d}_{stem}', 'input/IMG_1.jpg', 7) == '0007_IMG_1'
+
+
+@pytest.mark.parametrize('text_format', ['{stemm}', '{index:d', '{0}', '{name.size}'])
+def test_invalid_text_format_rejected_before_dispatch(tmp_path, text_format):
+    with pytest.raises(ValueError):
+        next(iter_watermark(str(tmp_path), 'missing_template', None, 30, config={'dynamic_text': text_format}))
+    assert not (tmp_path / 'output').exists()
+
+
+def _random_config(font_path, **extra):
+    return {'dynamic_text': '{stem}', 'dynamic_text_font': font_path, 'dynamic_text_size': 20,
+            'dynamic_text_style': 'random', 'dynamic_text_count': 6, **extra}
+
+
+def test_random_style_is_reproducible(font_path):
+    image = Image.new("RGB", (400, 300), (30, 30, 30))
+    config = _random_config(font_path)
+    first = np.asarray(add_dynamic_text(image.copy(), 'input/IMG_1.jpg', config, 3))
+    again = np.asarray(add_dynamic_text(image.copy(), 'input/IMG_1.jpg', config, 3))
+    other = np.asarray(add_dynamic_text(image.copy(), 'input/IMG_1.jpg', config, 4))
+    assert np.array_equal(first, again)
+    assert not np.array_equal(first, other)
+    # 配置了固定种子时与文件名、序号无关
+    fixed = _random_config(font_path, dynamic_text_seed=7)
+    assert dynamic_text_seed(fixed, 'input/IMG_1.jpg', 3) == dynamic_text_seed(fixed, 'input/IMG_2.jpg', 9) == 7
+
+
+def test_scattered_positions_follow_text_size(font_path):
+    """长文字按实际墨迹尺寸定位：五处印章都在图内且互不重叠"""
+    sprite = stamp_sprite('a_rather_long_file_name_0001', font_path, 24)
+    height, width = sprite.mask.shape
+    image_size = (3 * width, 5 * height)
+    xs, ys = scattered_positions(image_size, sprite)
+    left, top = xs + sprite.offset[0], ys + sprite.offset[1]
+    assert np.all((left >= 0) & (left + width <= image_size[0]) & (top >= 0) & (top + height <= image_size[1]))
+    assert overlap_layers(left, top, (width, height)).max() == 0
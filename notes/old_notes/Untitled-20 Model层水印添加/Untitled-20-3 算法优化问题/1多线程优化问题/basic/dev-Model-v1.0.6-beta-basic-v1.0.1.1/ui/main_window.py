@@ -212,7 +212,7 @@ class MainWindow(IMainWindow):
     def _create_opacity_input(self, layout):
         # 不透明度输入
         self.opacity_input = QLineEdit()
-        self.opacity_input.setPlaceholderText("请输入不透明度，默认50%")
+        self.opacity_input.setPlaceholderText("请输入不透明度，留空使用水印类型的默认值")
         layout.addWidget(self.opacity_input)
 
     def _create_generate_button(self, layout):
@@ -0,0 +1,83 @@
+import os
+import hashlib
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# 缓存文件扩展名（内容为预处理后底图的 JPEG/PNG 字节）
+_CACHE_SUFFIX = ".bin"
+
+
+def base_cache_key(image_path, *params):
+    """缓存键：输入文件内容的 sha1 加上影响预处理结果的参数（输出高度、质量、解码模式等）"""
+    digest = hashlib.sha1()
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    digest.update(repr(params).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _cache_path(cache_dir, key):
+    # 按前两位分目录，避免单个目录下文件过多
+    return os.path.join(cache_dir, key[:2], key + _CACHE_SUFFIX)
+
+
+def read_base_cache(cache_dir, key):
+    """读取缓存的底图字节，未命中返回 None；命中时刷新修改时间供淘汰使用"""
+    path = _cache_path(cache_dir, key)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+    except OSError:
+        return None
+    return data
+
+
+def write_base_cache(cache_dir, key, data):
+    """写入缓存：先写临时文件再 os.replace，多个进程同时写同一个键也不会读到半截文件"""
+    path = _cache_path(cache_dir, key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    except OSError as e:
+        # 缓存写入失败不影响本次处理
+        logger.warning(f"写入底图缓存失败 {path}: {e}")
+
+
+def evict_base_cache(cache_dir, max_bytes):
+    """按修改时间从旧到新删除缓存文件，直到总大小不超过 max_bytes，返回删除的文件数"""
+    entries = []
+    total = 0
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            if not name.endswith(_CACHE_SUFFIX):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
@@ -1,12 +1,26 @@
 import io
 import sys
 import glob
+import math
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageFile, ImageOps
 import os
 import yaml
 import logging
-from multiprocessing import Pool, cpu_count
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import NamedTuple, Optional
+from multiprocessing import Pool, BoundedSemaphore, cpu_count, shared_memory, resource_tracker
+from utils.base_cache import base_cache_key, read_base_cache, write_base_cache, evict_base_cache
+from utils.buffers import PIXEL_BYTES, BufferPool, map_image
+from utils.composite import (prepare_template, prepare_luma_template, composite_over, is_achromatic,
+                             apply_opacity, template_region, TiledTemplate, LUMA_BLEND_MODES, STRIP_ROWS)
+from utils.text_watermark import (TEXT_STYLES, stamp_text, add_tiled_watermark, add_scattered_watermark,
+                                  add_random_watermark)
+from utils.distance_field import render_field_template
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -21,104 +35,866 @@ def load_image(image_path):
         raise FileNotFoundError(f"图片文件 {image_path} 不存在")
     return Image.open(image_path)
 
+# EXIF 方向为 5-8 时图片需要旋转 90°，宽高互换
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+def _target_sizes(image, target_height):
+    """按目标高度计算缩放尺寸，返回 (存储方向的尺寸, 摆正后的尺寸)"""
+    orientation = image.getexif().get(0x0112, 1)
+    transposed = orientation in _TRANSPOSED_ORIENTATIONS
+
+    # 目标尺寸按摆正后的方向计算，再换算回存储方向
+    stored_width, stored_height = image.size
+    display_width, display_height = (stored_height, stored_width) if transposed else (stored_width, stored_height)
+    scale = target_height / display_height
+    target_width = int(display_width * scale)
+    target_size = (target_height, target_width) if transposed else (target_width, target_height)
+    return target_size, (target_width, target_height)
+
+def probe_output_size(image_path, target_height):
+    """只读取文件头，返回图片缩放到目标高度（并摆正）后的尺寸"""
+    with load_image(image_path) as image:
+        return _target_sizes(image, target_height)[1]
+
+# 超大图片按条带缩放时每条的输出行数上限，以及每条所需源图行解码后占用的字节上限
+_RESIZE_BAND_ROWS = 256
+_RESIZE_BAND_BYTES = 16 * 1024 * 1024
+
+# EXIF 方向 -> 摆正所需的变换（与 ImageOps.exif_transpose 一致）
+_ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# Image.reduce 支持且按像素值取平均有意义的模式；其余模式（P/PA/1、16 位灰度 I;16 等）直接 resize
+_REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA", "CMYK", "YCbCr", "I", "F")
+
+def _reduce_for(image, target_size):
+    """非 JPEG 图片先按整数倍 reduce 到仍不小于目标尺寸，模式不支持时原样返回"""
+    if image.mode not in _REDUCIBLE_MODES:
+        return image
+    factor = min(image.width // target_size[0], image.height // target_size[1])
+    return image.reduce(factor) if factor >= 2 else image
+
+# 工作进程共用的超大图片解码名额（跨进程信号量，由 init_worker 设置）
+_large_decode_slots = None
+
+def _spill_array(shape, spill_bytes, spill_dir=None):
+    """分配 uint8 数组；不小于 spill_bytes 时放到磁盘上的 np.memmap"""
+    if math.prod(shape) >= spill_bytes:
+        with tempfile.TemporaryFile(dir=spill_dir) as spill_file:
+            return np.memmap(spill_file, dtype=np.uint8, mode="w+", shape=shape)
+    return np.empty(shape, dtype=np.uint8)
+
+def _raw_row_reader(image):
+    """源图全部以 raw 编码存放（BMP、PPM、未压缩的 TIFF 等）时，返回只解码行区间 [top, bottom) 的函数，否则返回 None"""
+    if not image.tile or any(tile.codec_name != "raw" for tile in image.tile):
+        return None
+    tiles = []
+    for tile in image.tile:
+        args = tile.args if isinstance(tile.args, tuple) else (tile.args,)
+        rawmode, stride, orientation = args + (0, 1)[len(args) - 1:]
+        x0, y0, x1, y1 = tile.extents
+        if not stride:
+            try:
+                stride = len(Image.new(image.mode, (x1 - x0, 1)).tobytes("raw", rawmode))
+            except ValueError:
+                return None
+        tiles.append((tile.extents, tile.offset, rawmode, stride, orientation))
+
+    band = None
+
+    def read(top, bottom):
+        # 行数相同的条带复用同一张图片
+        nonlocal band
+        if band is None or band.size != (image.width, bottom - top):
+            band = None  # 先释放上一张，再分配新的条带
+            band = Image.new(image.mode, (image.width, bottom - top))
+        for (x0, y0, x1, y1), offset, rawmode, stride, orientation in tiles:
+            first, last = max(top, y0), min(bottom, y1)
+            if first >= last:
+                continue
+            # orientation 为负时文件中的行自下而上存放（如 BMP）
+            image.fp.seek(offset + (first - y0 if orientation > 0 else y1 - last) * stride)
+            decoder = Image._getdecoder(image.mode, "raw", (rawmode, stride, orientation))
+            try:
+                decoder.setimage(band.im, (x0, first - top, x1, last - top))
+                data = b""
+                while True:
+                    chunk = image.fp.read(ImageFile.SAFEBLOCK)
+                    if not chunk:
+                        raise OSError(f"图片数据不完整（第 {first}-{last} 行）")
+                    consumed = decoder.decode(data + chunk)[0]
+                    if consumed < 0:
+                        break
+                    data = (data + chunk)[consumed:]
+            finally:
+                decoder.cleanup()
+        return band
+
+    return read
+
+def _decode_spilled(image, spill_bytes, spill_dir=None):
+    """整张解码源图；解码后不小于 spill_bytes 且模式可映射时直接解码到磁盘上的 np.memmap，不占用堆内存"""
+    width, height = image.size
+    if image.tile and image.mode in PIXEL_BYTES:
+        array = _spill_array((height, width, PIXEL_BYTES[image.mode]), spill_bytes, spill_dir)
+        if isinstance(array, np.memmap):
+            image.im = map_image(array, image.mode, image.size).im
+    image.load()
+    return image
+
+def _resize_in_bands(image, target_size, spill_bytes=64 * 1024 * 1024, spill_dir=None):
+    """按行条带解码并缩放，逐条写入输出数组（不小于 spill_bytes 时为磁盘上的 np.memmap），返回映射到其上的图片
+
+    image 为未解码的源图，模式须在 PIXEL_BYTES 中。raw 编码的源图每条只解码滤波窗口覆盖的行；
+    PNG、JPEG 等单个压缩数据流无法按行解码，整张解码（见 _decode_spilled）后按条带缩放。
+    每条用 resize(box=...) 取对应的行区间，滤波系数与整图缩放相同
+    """
+    width, height = target_size
+    scale = image.height / height
+    read = _raw_row_reader(image)
+    if read is None:
+        _decode_spilled(image, spill_bytes, spill_dir)
+    # 缩小时 BICUBIC 的支撑半径随缩放比例放大，每条多取 margin 行源图
+    margin = math.ceil(2 * max(scale, 1)) + 1
+    rows = int(_RESIZE_BAND_BYTES / (scale * image.width * PIXEL_BYTES[image.mode]))
+    rows = max(1, min(_RESIZE_BAND_ROWS, rows))
+    # 每条读取同样多的源图行（靠近上下边缘时窗口整体移入图内），条带图片可以一直复用
+    window = min(image.height, math.ceil(rows * scale) + 2 * margin + 2)
+    result = _spill_array((height, width, PIXEL_BYTES[image.mode]), spill_bytes, spill_dir)
+    output = map_image(result, image.mode, target_size)
+    for top in range(0, height, rows):
+        bottom = min(top + rows, height)
+        box_top, box_bottom = top * scale, bottom * scale
+        if read is None:
+            band, first = image, 0
+        else:
+            first = min(max(0, int(box_top) - margin), image.height - window)
+            band = read(first, first + window)
+        output.paste(band.resize((width, bottom - top), box=(0, box_top - first, image.width, box_bottom - first)),
+                     (0, top))
+    return output
+
+def _load_scaled_tiled(image, target_size, orientation, draft_mode, spill_bytes, spill_dir):
+    """超大图片的加载：占用一个跨进程解码名额，按条带解码并缩放（JPEG 先按 draft 缩小解码），随即释放源图"""
+    if _large_decode_slots is not None:
+        _large_decode_slots.acquire()
+    try:
+        if image.format == "JPEG":
+            image.draft(draft_mode or image.mode, target_size)
+        if image.mode in PIXEL_BYTES:
+            image = _resize_in_bands(image, target_size, spill_bytes, spill_dir)
+        else:
+            image = _reduce_for(image, target_size).resize(target_size)
+    finally:
+        if _large_decode_slots is not None:
+            _large_decode_slots.release()
+    method = _ORIENTATION_TRANSPOSE.get(orientation)
+    return image.transpose(method) if method is not None else image
+
+def _pillow_frames(buffers):
+    """有缓冲池时把 with 块内 PIL 新建的图像登记为整帧分配（见 BufferPool.pillow）"""
+    return buffers.pillow() if buffers is not None else nullcontext()
+
+def load_scaled_image(image_path, target_height, draft_mode=None, tiled_pixels=0, spill_bytes=64 * 1024 * 1024,
+                      spill_dir=None, buffers=None):
+    """按目标高度加载图片
+
+    JPEG 通过 draft 在 DCT 域直接以缩小比例解码（取仍不小于目标尺寸的最大缩放），
+    其他格式先用 reduce 做整数倍缩小，最后再精确缩放到目标尺寸；
+    EXIF 方向在缩小之后再应用；draft_mode 指定 JPEG 的解码色彩空间（如 "YCbCr"），
+    能否生效以返回图片的 mode 为准。
+    源图像素数不低于 tiled_pixels（大于 0 时）按超大图片处理：限制同时解码的进程数，按条带解码并缩放
+    （见 _resize_in_bands），raw 编码的源图（BMP、PPM、未压缩 TIFF）单张的峰值内存只有一个条带。
+    传入 buffers（BufferPool）时源图直接解码到其中复用的画布，之后的缩小、缩放与摆正登记为整帧分配
+    """
+    image = load_image(image_path)
+    target_size = _target_sizes(image, target_height)[0]
+    stored_width, stored_height = image.size
+    if 0 < tiled_pixels <= stored_width * stored_height:
+        image = _load_scaled_tiled(image, target_size, image.getexif().get(0x0112, 1), draft_mode, spill_bytes,
+                                   spill_dir)
+        if buffers is not None:
+            # 条带缩放的中间结果只有条带大小，只登记输出这一帧
+            buffers.record(image.width * image.height * len(image.getbands()))
+        return image
+
+    jpeg = image.format == "JPEG"
+    if jpeg:
+        image.draft(draft_mode or image.mode, target_size)
+    if buffers is not None:
+        image = buffers.decode(image, "source")
+    with _pillow_frames(buffers):
+        if not jpeg:
+            image = _reduce_for(image, target_size)
+        image = image.resize(target_size)
+        if buffers is None:
+            return ImageOps.exif_transpose(image)
+        # 不需要摆正时 exif_transpose 也会整帧复制一份，这里直接返回缩放结果
+        if image.getexif().get(0x0112, 1) not in _ORIENTATION_TRANSPOSE:
+            return image
+        return ImageOps.exif_transpose(image)
+
 # 读取npy文件
 def load_npy(npy_path):
     if not os.path.exists(npy_path):
         raise FileNotFoundError(f"npy文件 {npy_path} 不存在")
     return np.load(npy_path)
 
-def overlay_and_crop(base_image, npy_data):
-    """叠加水印并裁剪"""
-    # print(f"npy_data.shape = {npy_data.shape}")
-    watermark_image = Image.fromarray(npy_data)
-    # 获取图片和水印的尺寸
+def resolve_template_path(watermark_type):
+    """水印模板文件：优先整幅的 {watermark_type}.npy，没有时使用同名的周期瓦片 .npz（generate_npy.py 瓦片模式）"""
+    npy_path = f"{watermark_type}.npy"
+    tile_path = f"{watermark_type}.npz"
+    if not os.path.exists(npy_path) and os.path.exists(tile_path):
+        return tile_path
+    return npy_path
+
+def load_template_tile(tile_path, field_params=None):
+    """读取周期瓦片：npz 中的 rgba 数组，或距离场模板（field）按 field_params 换算出的 RGBA"""
+    with np.load(tile_path) as data:
+        if "field" in data:
+            tile = render_field_template(data, **(field_params or {}))
+        else:
+            tile = np.ascontiguousarray(data["rgba"], dtype=np.uint8)
+    if tile.ndim != 3 or tile.shape[2] != 4:
+        raise ValueError(f"瓦片 {tile_path} 不是 RGBA 数组: {tile.shape}")
+    return tile
+
+# 工作进程内的共享水印模板（由 init_worker 在进程启动时挂载）
+_worker_template = None
+_worker_template_id = None
+_worker_shm = None
+
+# 工作进程内复用的画布、叠加工作区与编码缓冲
+_worker_buffers = BufferPool()
+
+# 工作进程内按输出尺寸缓存的水印模板（LRU）
+_template_cache = OrderedDict()
+_template_cache_size = 4
+
+# 工作进程内缓存的模板是否为中性灰（按模板标识）
+_achromatic_cache = {}
+
+def distance_field_params(config):
+    """配置中距离场模板的运行时参数（sdf_*），未配置或为 null 的项沿用生成时的值"""
+    keys = ("line_width", "shadow_width", "feather", "fog_width", "fog_radius")
+    return {key: config[f"sdf_{key}"] for key in keys if config.get(f"sdf_{key}") is not None}
+
+def share_template(npy_path, mode="shm", template_id=None, field_params=None):
+    """发布水印模板供进程池共享，返回 (SharedMemory 或 None, 模板描述)
+
+    shm: 模板只加载一次并拷贝到共享内存，工作进程按名称挂载
+    mmap: 工作进程各自以只读内存映射打开 npy 文件，由系统页缓存共享
+    .npz 周期瓦片只有几 MB 以内，不论 mode 都直接随模板描述传给工作进程（tile 模式）；
+    距离场模板在这里按 field_params 换算为 RGBA 瓦片，工作进程拿到的与普通瓦片相同
+    """
+    if not os.path.exists(npy_path):
+        raise FileNotFoundError(f"npy文件 {npy_path} 不存在")
+    if npy_path.endswith(".npz"):
+        return None, {"mode": "tile", "tile": load_template_tile(npy_path, field_params), "id": template_id}
+    if mode == "mmap":
+        return None, {"mode": "mmap", "path": os.path.abspath(npy_path), "id": template_id}
+    if mode != "shm":
+        raise ValueError(f"不支持的模板共享模式: {mode}")
+
+    npy_data = np.load(npy_path, mmap_mode="r")
+    shm = shared_memory.SharedMemory(create=True, size=max(npy_data.nbytes, 1))
+    shared = np.ndarray(npy_data.shape, dtype=npy_data.dtype, buffer=shm.buf)
+    shared[...] = npy_data
+    del shared
+    return shm, {"mode": "shm", "name": shm.name, "shape": npy_data.shape, "dtype": npy_data.dtype.str,
+                 "id": template_id}
+
+def _attach_shared_memory(name):
+    try:
+        # Python 3.13+：挂载方不登记到 resource_tracker，避免退出时误删
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+def open_shared_template(template_spec, shm=None):
+    """按模板描述以只读方式打开共享模板，返回 (SharedMemory 或 None, 数组)；shm 为创建方已持有的共享内存"""
+    if template_spec["mode"] == "mmap":
+        return None, np.load(template_spec["path"], mmap_mode="r")
+    if template_spec["mode"] == "tile":
+        tile = template_spec["tile"]
+        tile.flags.writeable = False
+        return None, TiledTemplate(tile)
+    shm = shm or _attach_shared_memory(template_spec["name"])
+    template = np.ndarray(template_spec["shape"], dtype=np.dtype(template_spec["dtype"]), buffer=shm.buf)
+    template.flags.writeable = False
+    return shm, template
+
+def init_worker(template_spec, cache_size=4, decode_slots=None):
+    """进程池初始化函数：挂载共享水印模板（只读），记录超大图片的解码名额"""
+    global _worker_template, _worker_template_id, _worker_shm, _template_cache_size, _large_decode_slots
+    global _worker_buffers
+    _large_decode_slots = decode_slots
+    _worker_buffers = BufferPool()
+    _worker_template_id = template_spec.get("id")
+    _template_cache_size = cache_size
+    _template_cache.clear()
+    _achromatic_cache.clear()
+    _worker_shm, _worker_template = open_shared_template(template_spec)
+
+def get_worker_template():
+    if _worker_template is None:
+        raise RuntimeError("水印模板未初始化，请通过 init_worker 启动进程池")
+    return _worker_template
+
+def _build_cropped_template(npy_data, width, height, opacity=None, base_mode="RGB", blend_mode="normal", top=0):
+    """按输出尺寸裁剪水印模板（只切片需要的区域，不再整张转换）并预计算预乘 alpha"""
+    # 裁剪水印超出图片的部分（周期瓦片按需平铺）；模板比图片小的方向保持原尺寸，叠加时其余区域不受影响
+    cropped = template_region(npy_data, width, height, top)
+    # 透明度通过查找表作用在裁剪后的 alpha 上，随模板一起按 (模板, 尺寸, 透明度) 缓存
+    cropped = apply_opacity(cropped, opacity)
+    if base_mode == "YCbCr":
+        return prepare_luma_template(cropped, blend_mode)
+    return prepare_template(cropped, 4 if base_mode == "RGBA" else 3, blend_mode)
+
+def get_cropped_template(npy_data, template_id, width, height, opacity=None, base_mode="RGB", blend_mode="normal",
+                         top=0):
+    """获取裁剪并预处理后的水印模板，按 (模板, 宽, 高, 透明度, 底图模式, 混合模式) 在工作进程内做 LRU 缓存
+
+    top 为模板的起始行（条带并行时使用），调用方需把它编入 template_id
+    """
+    if template_id is None:
+        return _build_cropped_template(npy_data, width, height, opacity, base_mode, blend_mode, top)
+
+    key = (template_id, width, height, opacity, base_mode, blend_mode)
+    template = _template_cache.get(key)
+    if template is not None:
+        _template_cache.move_to_end(key)
+        return template
+
+    template = _build_cropped_template(npy_data, width, height, opacity, base_mode, blend_mode, top)
+    _template_cache[key] = template
+    while len(_template_cache) > max(_template_cache_size, 1):
+        _template_cache.popitem(last=False)
+    return template
+
+def template_is_achromatic(npy_data, template_id=None):
+    """水印模板是否为中性灰，按模板标识缓存检查结果"""
+    if isinstance(npy_data, TiledTemplate):
+        npy_data = npy_data.tile
+    if template_id is None:
+        return is_achromatic(npy_data)
+    if template_id not in _achromatic_cache:
+        _achromatic_cache[template_id] = is_achromatic(npy_data)
+    return _achromatic_cache[template_id]
+
+def overlay_and_crop(base_image, npy_data, template_id=None, opacity=None, blend_mode="normal", buffers=None):
+    """叠加水印并裁剪
+
+    YCbCr 底图（亮度快速通道）要求水印为中性灰且混合模式属于 LUMA_BLEND_MODES；
+    传入 buffers（BufferPool）时直接在底图所在的池内画布上原地叠加（底图不在池中时先 paste 到画布上），
+    叠加工作区也从中复用；返回的就是池内画布，须在下次使用前保存。模式转换等池外的整帧分配登记到 buffers
+    """
+    if base_image.mode not in ("RGB", "RGBA", "YCbCr"):
+        if blend_mode == "normal":
+            # 其他模式交给 PIL 处理（由 paste 负责模式转换）
+            with _pillow_frames(buffers):
+                watermark_image = Image.fromarray(np.ascontiguousarray(
+                    apply_opacity(template_region(npy_data, base_image.width, base_image.height), opacity)))
+                base_image.paste(watermark_image, (0, 0), watermark_image)  # 使用alpha通道（如果存在）
+            return base_image
+        has_alpha = "A" in base_image.mode or "transparency" in base_image.info
+        with _pillow_frames(buffers):
+            base_image = base_image.convert("RGBA" if has_alpha else "RGB")
+
+    # 获取图片尺寸，取出（缓存的）已裁剪水印
     base_width, base_height = base_image.size
-    watermark_width, watermark_height = watermark_image.size
+    template = get_cropped_template(npy_data, template_id, base_width, base_height, opacity,
+                                    base_image.mode, blend_mode)
+
+    # 在底图的 uint8 数组上原地完成预乘 alpha 叠加，结果与 paste 一致
+    if buffers is None:
+        base = np.array(base_image)
+        composite_over(base, template)
+        return Image.fromarray(base, base_image.mode)
+    base_image = _pooled(base_image, buffers, "canvas")
+    composite_over(buffers.pixels(base_image), template, buffers)
+    return base_image
+
+def _pooled(image, buffers, name):
+    """image 已在缓冲池中时原样返回，否则逐行 paste 到池内图片 name（不经过临时数组）"""
+    if buffers.pixels(image) is not None:
+        return image
+    canvas = buffers.image(name, image.mode, image.size)
+    canvas.paste(image)
+    canvas.info.update(image.info)
+    return canvas
+
+def overlay_batch(base_images, npy_data, template_id=None, opacity=None, blend_mode="normal", buffers=None):
+    """把同一水印叠加到一组尺寸、模式相同的底图上（RGB/RGBA/YCbCr），返回新图片列表
+
+    模板只取一次：没有缓冲池时底图堆叠为 (N, H, W, C) 数组，模板在批维度上广播；
+    传入 buffers 时各底图已解码在各自的池内画布上（见 process_image_group），逐张原地叠加，不再复制整帧
+    """
+    mode, size = base_images[0].mode, base_images[0].size
+    if any(image.mode != mode or image.size != size for image in base_images):
+        raise ValueError("批量叠加要求所有底图尺寸与模式相同")
+    template = get_cropped_template(npy_data, template_id, size[0], size[1], opacity, mode, blend_mode)
+    if buffers is None:
+        stack = np.stack([np.asarray(image) for image in base_images])
+        composite_over(stack, template)
+        return [Image.fromarray(base, mode) for base in stack]
+    results = []
+    for n, image in enumerate(base_images):
+        image = _pooled(image, buffers, f"batch_canvas_{n}")
+        composite_over(buffers.pixels(image), template, buffers)
+        results.append(image)
+    return results
 
-    # 裁剪水印超出图片的部分
-    if watermark_width > base_width or watermark_height > base_height:
-        watermark_image = watermark_image.crop((0, 0, base_width, base_height))
+def use_luma_path(config, output_path, npy_data, template_id=None):
+    """是否走亮度快速通道：JPEG 输出、已开启 luma_fast_path、混合模式支持且水印为中性灰"""
+    return (config.get('luma_fast_path', False)
+            and os.path.splitext(output_path)[1].lower() in (".jpeg", ".jpg")
+            and config.get('blend_mode', 'normal') in LUMA_BLEND_MODES
+            and template_is_achromatic(npy_data, template_id))
 
-    # 将水印覆盖到图片的左上角
-    base_image.paste(watermark_image, (0, 0), watermark_image)  # 使用alpha通道（如果存在）
+def prepare_base_image(input_path, output_path, config, npy_data, quality=30, template_id=None, buffers=None,
+                       canvas="canvas"):
+    """加载并预处理底图：缩小解码后再精确缩放到输出高度，按输出质量重新压缩
+
+    配置了 base_cache_dir 时，重新压缩后的字节按 (文件内容, 输出高度, 质量, 解码模式) 缓存到磁盘，
+    重复处理同一批图片时直接复用；传入 buffers 时重新压缩使用其中复用的 BytesIO，
+    结果直接解码到池内图片 canvas（返回前已解码完毕）
+    """
+    # 亮度快速通道：JPEG 直接解码为 YCbCr，叠加后原样编码，省去两次 RGB 色彩转换
+    draft_mode = "YCbCr" if use_luma_path(config, output_path, npy_data, template_id) else None
+    tiled_pixels = int(config.get('tiled_pixels', 0))
+    cache_dir = config.get('base_cache_dir')
+    cache_key = None
+    if cache_dir:
+        cache_key = base_cache_key(input_path, config['output_height'], quality, draft_mode, tiled_pixels)
+        data = read_base_cache(cache_dir, cache_key)
+        if data is not None:
+            return _open_prepared_base(io.BytesIO(data), draft_mode, buffers, canvas)
+
+    base_image = load_scaled_image(input_path, config['output_height'], draft_mode,
+                                   tiled_pixels=tiled_pixels,
+                                   spill_bytes=int(config.get('tiled_spill_mb', 64)) * 1024 * 1024,
+                                   spill_dir=config.get('tiled_spill_dir'), buffers=buffers)
+    # if base_image.mode != "RGBA":
+    #     base_image = base_image.convert("RGBA")
+
+    buffer = buffers.stream("encode") if buffers is not None else io.BytesIO()
+    if base_image.mode in ("RGB", "YCbCr"):
+        base_image.save(buffer, format="JPEG", quality=quality)
+    else:
+        # PNG 压缩（无损但有压缩级别）
+        base_image.save(buffer, format="PNG", compress_level=7)  # 最高压缩级别
+    if cache_key is not None:
+        write_base_cache(cache_dir, cache_key, buffer.getvalue())
+    buffer.seek(0)
+    return _open_prepared_base(buffer, draft_mode, buffers, canvas)
+
+def _open_prepared_base(buffer, draft_mode=None, buffers=None, canvas="canvas"):
+    """打开重新压缩后的底图（JPEG 按 draft_mode 指定的色彩空间解码）；
+    传入 buffers 时立即解码到池内图片 canvas，之后 buffer 可复用"""
+    base_image = Image.open(buffer)
+    if draft_mode and base_image.format == "JPEG":
+        base_image.draft(draft_mode, None)
+    if buffers is not None:
+        base_image = buffers.decode(base_image, canvas)
     return base_image
 
-def process_single_image(input_path, output_path, config, npy_data, quality=30):
-    """处理单张图片"""
+def format_dynamic_text(text_format, input_path, index=0):
+    """按格式串生成逐图文字：{name} 文件名 / {stem} 不含扩展名 / {parent} 所在文件夹 / {index} 序号（如 {index:04d}）"""
+    name = os.path.basename(input_path)
+    return text_format.format(name=name, stem=os.path.splitext(name)[0],
+                              parent=os.path.basename(os.path.dirname(os.path.abspath(input_path))), index=index)
+
+def validate_dynamic_text(text_format):
+    """派发任务前检查格式串，字段名或格式写错时直接报错，而不是在每个工作进程里逐张失败"""
     try:
-        # 加载并预处理图片
-        base_image = load_image(input_path)
-        # if base_image.mode != "RGBA":
-        #     base_image = base_image.convert("RGBA")
-
-        scale = config['output_height'] / base_image.height
-        width = int(base_image.width * scale)
-        base_image = base_image.resize((width, config['output_height']))
-        if base_image.mode == "RGB":
-            buffer = io.BytesIO()
-            base_image.save(buffer, format="JPEG", quality=quality)
-            buffer.seek(0)
-            base_image = Image.open(buffer)
-        else:
-            # PNG 压缩（无损但有压缩级别）
-            buffer = io.BytesIO()
-            base_image.save(buffer, format="PNG", compress_level=7)  # 最高压缩级别
-            buffer.seek(0)
-            base_image = Image.open(buffer)
-        # npy_data = npy_data.resize((config['output_height'], config['output_height']))
-        np.resize(npy_data, (config['output_height'], config['output_height']))
-        # 应用水印
-        watermarked = overlay_and_crop(base_image, npy_data)
+        format_dynamic_text(text_format, os.path.join('input', 'sample.jpg'), 1)
+    except (KeyError, IndexError, ValueError, AttributeError) as e:
+        raise ValueError(f"dynamic_text 格式串无效: {text_format!r}（{type(e).__name__}: {e}），"
+                         f"可用字段: {{name}} {{stem}} {{parent}} {{index}}") from e
+
+def dynamic_text_seed(config, input_path, index=0):
+    """random 排布的随机种子：配置了 dynamic_text_seed 时直接使用，否则由文件名与序号得到，同一输入重跑时位置不变"""
+    seed = config.get('dynamic_text_seed')
+    if seed is not None:
+        return int(seed)
+    return zlib.crc32(f"{os.path.basename(input_path)}:{index}".encode('utf-8'))
 
+def add_dynamic_text(image, input_path, config, index=0, buffers=None):
+    """按配置 dynamic_text 在输出图片上叠加逐图变化的文字（文件名、SKU、序号等）
 
-        if os.path.splitext(output_path)[1] in [".jpeg", ".jpg"]:
+    静态水印模板照常缓存，这里只渲染文字所在的小块区域；格式串字段见 format_dynamic_text，
+    index 为图片在本批中的序号（按枚举顺序从 1 开始，与完成顺序无关）。
+    dynamic_text_style 为 corner 时按 dynamic_text_position 叠加一处，
+    tiled / scattered / random 时平铺 / 四角加中心 / 随机分布，逐处按底图亮度取黑/白文字
+    （传入 buffers 且图片在池中时原地叠加，只有亮度采样的灰度图登记为整帧分配）
+    """
+    text_format = config.get('dynamic_text')
+    if not text_format:
+        return image
+    text = format_dynamic_text(text_format, input_path, index)
+    font_path = config.get('dynamic_text_font', 'arial.ttf')
+    font_size = int(config.get('dynamic_text_size', 36))
+    style = config.get('dynamic_text_style', 'corner')
+    spacing = int(config.get('dynamic_text_spacing', 100))
+    pixels = buffers.pixels(image) if buffers is not None else None
+    if style != 'corner' and buffers is not None:
+        # 亮度采样的灰度图：PIL 转换一帧，转成 numpy 数组再复制一帧
+        buffers.record(image.width * image.height)
+        buffers.record(image.width * image.height)
+    if style == 'tiled':
+        return add_tiled_watermark(image, text, font_path, font_size, spacing, pixels=pixels)
+    if style == 'scattered':
+        return add_scattered_watermark(image, text, font_path, font_size, pixels=pixels)
+    if style == 'random':
+        return add_random_watermark(image, text, font_path, font_size, int(config.get('dynamic_text_count', 10)),
+                                    dynamic_text_seed(config, input_path, index), spacing, pixels=pixels)
+    return stamp_text(image, text, font_path, font_size,
+                      config.get('dynamic_text_color', (255, 255, 255, 255)),
+                      config.get('dynamic_text_position', 'bottom_right'),
+                      int(config.get('dynamic_text_margin', 20)))
+
+def save_watermarked(watermarked, output_path, buffers=None):
+    """保存叠加结果；JPEG 输出只在模式不能直接编码时转换为 RGB（登记到 buffers）"""
+    if os.path.splitext(output_path)[1] in [".jpeg", ".jpg"] and watermarked.mode not in ("RGB", "YCbCr"):
+        with _pillow_frames(buffers):
             watermarked = watermarked.convert("RGB")
-        # watermarked = watermarked.convert("RGB")
-        # 保存结果
-        watermarked.save(output_path, quality=100)
+    # watermarked = watermarked.convert("RGB")
+    # 保存结果
+    watermarked.save(output_path, quality=100)
+
+def process_single_image(input_path, output_path, config, npy_data, quality=30, template_id=None, buffers=None,
+                         index=0):
+    """处理单张图片；buffers 为工作进程复用的缓冲池，返回本张图片的整帧分配次数（见 BufferPool）"""
+    allocations = buffers.allocations if buffers is not None else 0
+    try:
+        base_image = prepare_base_image(input_path, output_path, config, npy_data, quality, template_id, buffers)
+        # 应用水印
+        watermarked = overlay_and_crop(base_image, npy_data, template_id, config.get('opacity'),
+                                       blend_mode=config.get('blend_mode', 'normal'), buffers=buffers)
+        watermarked = add_dynamic_text(watermarked, input_path, config, index, buffers)
+        save_watermarked(watermarked, output_path, buffers)
+        allocations = buffers.allocations - allocations if buffers is not None else None
         logger.info(f"Processed: {os.path.basename(input_path)}")
+        logger.debug(f"Full-frame allocations for {os.path.basename(input_path)}: {allocations}")
+        return allocations
     except Exception as e:
         logger.exception(f"Error processing {input_path}: {str(e)}")
         raise
 
+class ImageResult(NamedTuple):
+    """单张图片的处理结果"""
+    input_path: str
+    output_path: str
+    error: Optional[str] = None
+    # 处理该图片时的整帧分配次数：缓冲池扩容与池外分配（缩放输出、模式转换等），没有缓冲池时为 None
+    allocations: Optional[int] = None
 
 
-def generate_watermark(input_folder, watermark_type, opacity, quality):
-    """批量生成水印"""
+# 可处理的图片格式 -> 文件名模式
+IMAGE_FORMATS = {'jpg': ('*.jpg', '*.jpeg'), 'png': ('*.png',)}
+
+def iter_image_files(input_folder, formats=None):
+    """惰性枚举待处理的图片文件；formats 为格式名列表（如 ['jpg']），为空时处理全部支持的格式"""
+    for fmt in formats or IMAGE_FORMATS:
+        for pattern in IMAGE_FORMATS[fmt]:
+            yield from glob.iglob(os.path.join(input_folder, pattern))
+
+
+def _throttled(iterable, pending, stop):
+    """限制已提交但未取回结果的任务数，避免任务队列随文件数增长"""
+    for item in iterable:
+        while not pending.acquire(timeout=0.1):
+            if stop.is_set():
+                return
+        yield item
+
+
+def _defer_large_images(items, target_height, min_pixels, deferred):
+    """输出像素数不低于 min_pixels 的图片移入 deferred，留到批次末尾按条带并行处理，其余照常放行"""
+    for item in items:
+        try:
+            width, height = probe_output_size(item[0], target_height)
+        except Exception:
+            width = height = 0
+        if width * height >= min_pixels:
+            deferred.append(item)
+        else:
+            yield item
+
+
+def process_large_image(pool, input_path, output_path, config, npy_data, quality=30, template_id=None, processes=None,
+                        index=0):
+    """在当前进程解码/编码一张超大图片，叠加按行条带分给进程池并行完成
+
+    底图放入共享内存，各工作进程用已挂载的模板处理自己的行区间（见 composite_strip_task）
+    """
+    try:
+        base_image = prepare_base_image(input_path, output_path, config, npy_data, quality, template_id)
+        blend_mode = config.get('blend_mode', 'normal')
+        opacity = config.get('opacity')
+        if base_image.mode not in ("RGB", "RGBA", "YCbCr"):
+            watermarked = overlay_and_crop(base_image, npy_data, template_id, opacity, blend_mode)
+        else:
+            base = np.asarray(base_image)
+            shm = shared_memory.SharedMemory(create=True, size=base.nbytes)
+            shared = np.ndarray(base.shape, dtype=base.dtype, buffer=shm.buf)
+            try:
+                shared[...] = base
+                # 条带高度取 STRIP_ROWS 的整数倍，每个进程一段
+                height = shared.shape[0]
+                processes = processes or cpu_count()
+                band = -(-height // (processes * STRIP_ROWS)) * STRIP_ROWS
+                tasks = [(shm.name, shared.shape, base_image.mode, opacity, blend_mode, top,
+                          min(top + band, height)) for top in range(0, height, band)]
+                pool.map(composite_strip_task, tasks)
+                watermarked = Image.fromarray(shared.copy(), base_image.mode)
+            finally:
+                del shared
+                shm.close()
+                shm.unlink()
+        watermarked = add_dynamic_text(watermarked, input_path, config, index)
+        save_watermarked(watermarked, output_path)
+        logger.info(f"Processed: {os.path.basename(input_path)}")
+    except Exception as e:
+        logger.exception(f"Error processing {input_path}: {str(e)}")
+        return ImageResult(input_path, output_path, str(e))
+    return ImageResult(input_path, output_path)
+
+
+# 批量模式下同时积攒的未满分组上限，超过后提前派发最早的分组
+_MAX_OPEN_GROUPS = 64
+
+def _iter_image_groups(items, target_height, batch_size, memory_limit):
+    """把 (输入路径, 输出路径, 序号) 按输出尺寸与扩展名分组，每组不超过 batch_size 张且堆叠数组不超过 memory_limit 字节
+
+    尺寸通过只读文件头预先得到；读取失败的图片单独成组，由工作进程报告错误
+    """
+    groups = OrderedDict()
+    for item in items:
+        input_path, output_path, _ = item
+        try:
+            width, height = probe_output_size(input_path, target_height)
+        except Exception:
+            yield [item]
+            continue
+        key = (width, height, os.path.splitext(output_path)[1].lower())
+        limit = max(min(batch_size, memory_limit // max(width * height * 4, 1)), 1)
+        group = groups.setdefault(key, [])
+        group.append(item)
+        if len(group) >= limit:
+            yield groups.pop(key)
+        elif len(groups) > _MAX_OPEN_GROUPS:
+            yield groups.popitem(last=False)[1]
+    yield from groups.values()
+
+
+def iter_watermark(input_folder, watermark_type, opacity, quality, config=None, chunksize=None, processes=None,
+                   blend_mode=None, dynamic_text=None, formats=None):
+    """流式批量生成水印：路径惰性送入进程池，按完成顺序逐张返回 ImageResult
+
+    配置 batch_mode 为真时，输出尺寸相同的图片按 batch_size / batch_memory_mb 分组，整组堆叠后一次叠加；
+    strip_parallel_pixels 大于 0 时，输出像素数达到该值的图片留到最后，由所有进程按条带并行叠加；
+    dynamic_text（格式串）非空时，每张图片在静态水印之上再叠加一行逐图文字；
+    formats 为要处理的图片格式列表（见 IMAGE_FORMATS），为空时处理全部支持的格式
+    """
     # 加载配置
-    with open('config.yaml', 'r') as f:
-        config = yaml.safe_load(f)['watermark']
+    if config is None:
+        with open('config.yaml', 'r') as f:
+            config = yaml.safe_load(f)['watermark']
+    if blend_mode:
+        config = {**config, 'blend_mode': blend_mode}
+    if dynamic_text is not None:
+        config = {**config, 'dynamic_text': dynamic_text}
+    formats = [str(fmt).lower() for fmt in formats or []]
+    if any(fmt not in IMAGE_FORMATS for fmt in formats):
+        raise ValueError(f"不支持的图片格式: {formats}，可选: {list(IMAGE_FORMATS)}")
+    if config.get('dynamic_text'):
+        validate_dynamic_text(config['dynamic_text'])
+        if config.get('dynamic_text_style', 'corner') not in TEXT_STYLES:
+            raise ValueError(f"不支持的文字排布: {config['dynamic_text_style']}，可选: {list(TEXT_STYLES)}")
+    # 透明度作为模板变换，在工作进程内随裁剪模板一起缓存
+    if opacity is not None:
+        config = {**config, 'opacity': opacity}
+    processes = processes or cpu_count()
+    chunksize = max(int(chunksize or config.get('chunksize', 1)), 1)
 
     # 初始化路径
     output_folder = os.path.join(input_folder, 'output')
     os.makedirs(output_folder, exist_ok=True)
 
-    # 加载水印数据
-    npy_path = f"{watermark_type}.npy"
+    # 加载水印数据：模板只加载一次，通过共享内存/内存映射分发给工作进程，不再随每个任务序列化
+    npy_path = resolve_template_path(watermark_type)
     # npy_data = load_npy(npy_path) * (opacity/100.0)
-    npy_data = load_npy(npy_path)
-
-
-    # 获取图片文件列表
-    supported_formats = ('*.jpg', '*.jpeg', '*.png')
-    image_files = []
-    for fmt in supported_formats:
-        image_files.extend(glob.glob(os.path.join(input_folder, fmt), recursive=True))
-
-    # for input_path in image_files:
-    #     file_name = os.path.basename(input_path)
-    #     output_path = os.path.join(output_folder, file_name)
-    #     process_single_image_wrapper(input_path, output_path, config, npy_data, quality)
-    # 批量处理
-    with Pool(processes=cpu_count()) as pool:
-        logger = logging.getLogger(__name__)
-        pool.starmap(process_single_image_wrapper,
-                     [(input_path, os.path.join(output_folder, os.path.basename(input_path)), config, npy_data,
-                       quality)
-                      for input_path in image_files])
-
-def process_single_image_wrapper(*arg):
-    return process_single_image(*arg)
+    shm, template_spec = share_template(npy_path, config.get('template_share', 'shm'), template_id=watermark_type,
+                                        field_params=distance_field_params(config))
+
+    # 序号按枚举顺序从 1 开始，供动态文字的 {index} 使用
+    items = ((input_path, os.path.join(output_folder, os.path.basename(input_path)), index)
+             for index, input_path in enumerate(iter_image_files(input_folder, formats), 1))
+    # 超大图片同时解码的进程数上限，防止多个进程同时持有整张源图导致内存耗尽
+    decode_slots = None
+    if int(config.get('tiled_pixels', 0)) > 0:
+        decode_slots = BoundedSemaphore(max(int(config.get('tiled_max_concurrent', 1)), 1))
+    large_items = []
+    strip_parallel_pixels = int(config.get('strip_parallel_pixels', 0))
+    if strip_parallel_pixels > 0:
+        items = _defer_large_images(items, config['output_height'], strip_parallel_pixels, large_items)
+        if os.name == "posix":
+            # 进程池启动前拉起 resource_tracker，让工作进程与主进程共用，避免各自登记底图共享内存
+            resource_tracker.ensure_running()
+    batch_mode = config.get('batch_mode', False)
+    if batch_mode:
+        groups = _iter_image_groups(items, config['output_height'], int(config.get('batch_size', 8)),
+                                    int(config.get('batch_memory_mb', 256)) * 1024 * 1024)
+        tasks = ((group, config, quality) for group in groups)
+        task_func = process_group_task
+    else:
+        tasks = ((input_path, output_path, config, quality, index) for input_path, output_path, index in items)
+        task_func = process_image_task
+    # 在途任务上限：保证每个进程都有活干，同时队列不会无限增长
+    pending = threading.BoundedSemaphore(processes * chunksize * 2)
+    stop = threading.Event()
+    try:
+        with Pool(processes=processes, initializer=init_worker,
+                  initargs=(template_spec, config.get('template_cache_size', 4), decode_slots)) as pool:
+            try:
+                for result in pool.imap_unordered(task_func, _throttled(tasks, pending, stop), chunksize):
+                    pending.release()
+                    if batch_mode:
+                        yield from result
+                    else:
+                        yield result
+                # 超大图片放在最后，此时所有进程都空闲，可以一起分担同一张图的叠加
+                if large_items:
+                    _, npy_data = open_shared_template(template_spec, shm)
+                    try:
+                        for input_path, output_path, index in large_items:
+                            yield process_large_image(pool, input_path, output_path, config, npy_data, quality,
+                                                      template_spec.get("id"), processes, index)
+                    finally:
+                        # 释放对共享内存的引用，之后才能关闭
+                        del npy_data
+            finally:
+                stop.set()
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+        # 批次结束后按总大小淘汰最久未使用的底图缓存
+        cache_dir = config.get('base_cache_dir')
+        if cache_dir and os.path.isdir(cache_dir):
+            removed = evict_base_cache(cache_dir, int(config.get('base_cache_max_mb', 2048)) * 1024 * 1024)
+            if removed:
+                logger.info(f"底图缓存淘汰 {removed} 个文件")
+
+
+def generate_watermark(input_folder, watermark_type, opacity, quality, blend_mode=None):
+    """批量生成水印"""
+    for _ in iter_watermark(input_folder, watermark_type, opacity, quality, blend_mode=blend_mode):
+        pass
+
+def process_image_task(task):
+    """工作进程任务：处理单张图片，异常转为结果返回，不中断整批处理"""
+    input_path, output_path, config, quality, index = task
+    try:
+        allocations = process_single_image_wrapper(input_path, output_path, config, quality, index)
+    except Exception as e:
+        return ImageResult(input_path, output_path, str(e))
+    return ImageResult(input_path, output_path, allocations=allocations)
+
+def process_image_group(items, config, npy_data, quality=30, template_id=None, buffers=None):
+    """批量处理输出尺寸相同的一组图片：同尺寸同模式的底图堆叠为 (N, H, W, C) 数组，一次叠加
+
+    items 为 [(输入路径, 输出路径, 序号), ...]，返回每张图片的 ImageResult；单张失败不影响同组其他图片。
+    每张底图解码到各自的池内画布；整组叠加时的整帧分配计入该组第一张图片
+    """
+    blend_mode = config.get('blend_mode', 'normal')
+    opacity = config.get('opacity')
+    results = {}
+    stacks = {}
+    allocations = {}
+
+    def count():
+        return buffers.allocations if buffers is not None else 0
+
+    for n, (input_path, output_path, index) in enumerate(items):
+        before = count()
+        try:
+            base_image = prepare_base_image(input_path, output_path, config, npy_data, quality, template_id, buffers,
+                                            canvas=f"canvas_{n}")
+        except Exception as e:
+            logger.exception(f"Error processing {input_path}: {str(e)}")
+            results[input_path] = ImageResult(input_path, output_path, str(e))
+            continue
+        allocations[input_path] = count() - before
+        if base_image.mode in ("RGB", "RGBA", "YCbCr"):
+            stacks.setdefault((base_image.mode, base_image.size), []).append(
+                (input_path, output_path, index, base_image))
+        else:
+            # 其他模式逐张处理
+            stacks[(input_path,)] = [(input_path, output_path, index, base_image)]
+
+    for key, members in stacks.items():
+        before = count()
+        try:
+            if len(key) == 1:
+                watermarked = [overlay_and_crop(members[0][3], npy_data, template_id, opacity, blend_mode,
+                                                buffers=buffers)]
+            else:
+                watermarked = overlay_batch([image for _, _, _, image in members], npy_data, template_id, opacity,
+                                            blend_mode, buffers=buffers)
+        except Exception as e:
+            logger.exception(f"Error processing group {key}: {str(e)}")
+            for input_path, output_path, _, _ in members:
+                results[input_path] = ImageResult(input_path, output_path, str(e))
+            continue
+        allocations[members[0][0]] += count() - before
+        for (input_path, output_path, index, _), image in zip(members, watermarked):
+            try:
+                before = count()
+                save_watermarked(add_dynamic_text(image, input_path, config, index, buffers), output_path, buffers)
+                allocations[input_path] += count() - before
+                logger.info(f"Processed: {os.path.basename(input_path)}")
+                results[input_path] = ImageResult(input_path, output_path,
+                                                  allocations=allocations[input_path] if buffers is not None else None)
+            except Exception as e:
+                logger.exception(f"Error processing {input_path}: {str(e)}")
+                results[input_path] = ImageResult(input_path, output_path, str(e))
+    return [results[input_path] for input_path, _, _ in items]
+
+def process_group_task(task):
+    """工作进程任务：批量处理一组输出尺寸相同的图片"""
+    items, config, quality = task
+    try:
+        return process_image_group(items, config, get_worker_template(), quality, template_id=_worker_template_id,
+                                   buffers=_worker_buffers)
+    except Exception as e:
+        return [ImageResult(input_path, output_path, str(e)) for input_path, output_path, _ in items]
+
+def composite_strip_task(task):
+    """工作进程任务：对共享内存中的底图叠加指定行区间（模板也只准备这一段，按行区间缓存）"""
+    shm_name, shape, mode, opacity, blend_mode, top, bottom = task
+    shm = _attach_shared_memory(shm_name)
+    try:
+        base = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        template = get_cropped_template(get_worker_template(), (_worker_template_id, top, bottom),
+                                        shape[1], bottom - top, opacity, mode, blend_mode, top)
+        composite_over(base[top:bottom], template)
+        del base
+    finally:
+        shm.close()
+
+def process_single_image_wrapper(input_path, output_path, config, quality, index=0):
+    return process_single_image(input_path, output_path, config, get_worker_template(), quality,
+                                template_id=_worker_template_id, buffers=_worker_buffers, index=index)
 
 if __name__ == "__main__":
     # 加载配置
@@ -0,0 +1,119 @@
+import io
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+# PIL 图片在内存中每像素占用的字节数（RGB / YCbCr 同样按 4 字节存放，第 4 字节为填充），
+# 这些模式的图片可以直接映射到池内数组
+PIXEL_BYTES = {"L": 1, "RGB": 4, "RGBA": 4, "CMYK": 4, "YCbCr": 4}
+
+
+def map_image(array, mode, size):
+    """返回与 uint8 数组 array（(H, W, PIXEL_BYTES[mode])，也可以是 np.memmap）共享内存的 PIL 图片
+
+    Image.frombuffer 只能映射 L / RGBA 等布局与原始字节相同的模式；RGB、YCbCr 在 PIL 内部同样是
+    每像素 4 字节，按 frombuffer 所用的 map_buffer 以相同步长映射
+    """
+    width = size[0]
+    core = Image.core.map_buffer(array, size, "raw", 0, (mode, width * PIXEL_BYTES[mode], 1))
+    return Image.new(mode, (0, 0))._new(core)
+
+
+class BufferPool:
+    """工作进程内复用的缓冲区
+
+    按名称保存可增长的扁平字节数组、映射到这些数组上的 PIL 图片与 BytesIO，同名请求复用同一块内存，
+    只在容量不够时扩容。allocations 统计真正发生的整帧分配，用于发现热路径上的分配回归：缓冲池扩容、
+    调用方用 record 登记的池外数组，以及 pillow() 块内 PIL 新建的图像（缩放输出及其中间结果、模式转换等
+    无法写入池内存的步骤，按 PIL 的图像计数实测）；allocated_bytes 为前两类的字节数
+    """
+
+    # 扩容时至少放大的倍数，避免尺寸略有增长时反复分配
+    GROWTH = 1.5
+
+    def __init__(self):
+        self._arrays = {}
+        self._streams = {}
+        self._images = {}
+        self.allocations = 0
+        self.allocated_bytes = 0
+
+    def array(self, name, shape, dtype=np.uint8):
+        """返回指定形状的数组视图（内容未初始化）；调用方在下次请求同名数组前用完"""
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        buffer = self._arrays.get(name)
+        if buffer is None or buffer.size < nbytes:
+            capacity = max(nbytes, int(buffer.size * self.GROWTH) if buffer is not None else 0)
+            buffer = np.empty(capacity, dtype=np.uint8)
+            self._arrays[name] = buffer
+            self.allocations += 1
+            self.allocated_bytes += capacity
+        return buffer[:nbytes].view(dtype).reshape(shape)
+
+    def record(self, nbytes):
+        """登记一次池外的整帧数组分配"""
+        self.allocations += 1
+        self.allocated_bytes += int(nbytes)
+
+    @contextmanager
+    def pillow(self):
+        """with 块内 PIL 新建的图像逐个计入 allocations（块内只应有整帧的 PIL 操作）"""
+        before = Image.core.get_stats()["new_count"]
+        try:
+            yield
+        finally:
+            self.allocations += Image.core.get_stats()["new_count"] - before
+
+    def image(self, name, mode, size):
+        """返回与池内数组 name 共享内存的 PIL 图片（内容未初始化），mode 须在 PIXEL_BYTES 中
+
+        解码（见 decode）、paste 与原地叠加都直接写入池内存；调用方在下次请求同名图片前用完
+        """
+        width, height = size
+        array = self.array(name, (height, width, PIXEL_BYTES[mode]))
+        image = map_image(array, mode, size)
+        self._images[name] = (image, array[..., :Image.getmodebands(mode)])
+        return image
+
+    def pixels(self, image):
+        """image 为本池映射的图片时返回其像素数组 (H, W, C) 的视图（RGB / YCbCr 按 4 字节步长），否则返回 None"""
+        for mapped, pixels in self._images.values():
+            if mapped is image:
+                return pixels
+        return None
+
+    def decode(self, image, name):
+        """把尚未解码的图片（Image.open / draft 之后）直接解码到池内图片 name，返回池内图片
+
+        模式不能映射时照常解码并登记一次分配；已经解码的图片原样返回
+        """
+        if not getattr(image, "tile", None):
+            return image
+        if image.mode not in PIXEL_BYTES:
+            with self.pillow():
+                image.load()
+            return image
+        canvas = self.image(name, image.mode, image.size)
+        # ImageFile.load 只在 im 为空时分配图像内存，预先挂上池内图片的 im 后解码器直接写入池内数组
+        image.im = canvas.im
+        image.load()
+        canvas.info.update(image.info)
+        return canvas
+
+    def stream(self, name):
+        """返回清空后的 BytesIO"""
+        stream = self._streams.get(name)
+        if stream is None:
+            stream = self._streams[name] = io.BytesIO()
+            self.allocations += 1
+        stream.seek(0)
+        stream.truncate()
+        return stream
+
+    def clear(self):
+        """释放所有缓冲区（计数保留）"""
+        self._arrays.clear()
+        self._streams.clear()
+        self._images.clear()
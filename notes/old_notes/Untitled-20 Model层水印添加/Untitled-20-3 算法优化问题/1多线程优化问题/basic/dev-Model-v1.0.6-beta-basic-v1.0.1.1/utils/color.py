@@ -0,0 +1,90 @@
+import numpy as np
+
+# 亮度的定点精度：线性亮度按 2^16 缩放
+LUMA_BITS = 16
+LUMA_ONE = 1 << LUMA_BITS
+
+# sRGB 编码值 (0-255) -> 线性光强度，按 LUMA_ONE 缩放；替代逐像素的 ((c + 0.055) / 1.055) ** 2.4
+_srgb = np.arange(256) / 255.0
+SRGB_TO_LINEAR = np.round(np.where(_srgb <= 0.04045, _srgb / 12.92,
+                                   ((_srgb + 0.055) / 1.055) ** 2.4) * (LUMA_ONE - 1)).astype(np.uint32)
+SRGB_TO_LINEAR.flags.writeable = False
+
+# BT.709 亮度权重预先乘进查找表，亮度 = 三次查表相加，结果在 [0, LUMA_ONE) 内
+_LUMA_WEIGHTS = (0.2126, 0.7152, 0.0722)
+_LUMA_LUTS = tuple(np.floor(SRGB_TO_LINEAR * w).astype(np.uint32) for w in _LUMA_WEIGHTS)
+for _lut in _LUMA_LUTS:
+    _lut.flags.writeable = False
+del _srgb, _lut
+
+
+def relative_luminance(rgb, out=None):
+    """uint8 sRGB 颜色 (..., 3|4) 的相对亮度（线性光），uint32，按 LUMA_ONE 缩放"""
+    out = np.take(_LUMA_LUTS[0], rgb[..., 0], out=out)
+    out += _LUMA_LUTS[1][rgb[..., 1]]
+    out += _LUMA_LUTS[2][rgb[..., 2]]
+    return out
+
+
+def srgb_to_linear(values):
+    """sRGB 编码值（0-255，可为小数）-> 线性光强度（0-1），逐元素，支持任意形状"""
+    values = np.asarray(values, dtype=np.float64) / 255.0
+    return np.where(values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4)
+
+
+def luminance(rgb):
+    """颜色数组 (..., 3|4) 的 WCAG 相对亮度（0-1），返回形状 (...)"""
+    linear = srgb_to_linear(np.asarray(rgb)[..., :3])
+    return linear @ np.array(_LUMA_WEIGHTS)
+
+
+def contrast_ratio(l1, l2):
+    """两组亮度的 WCAG 对比度（≥ 1，与参数顺序无关），按广播规则逐元素计算"""
+    l1, l2 = np.asarray(l1, dtype=np.float64), np.asarray(l2, dtype=np.float64)
+    return (np.maximum(l1, l2) + 0.05) / (np.minimum(l1, l2) + 0.05)
+
+
+def target_luminance_for_contrast(background_luminance, ratio):
+    """比背景更亮、且与背景对比度恰为 ratio 所需的亮度（可能超过 1，表示提亮无法达到）"""
+    return ratio * (np.asarray(background_luminance, dtype=np.float64) + 0.05) - 0.05
+
+
+def contrast_target_luminance(background_luminance, ratio):
+    """与背景对比度为 ratio 的目标亮度（0-1），逐元素
+
+    优先比背景更亮；提亮超出 1 时改为比背景更暗；两个方向都达不到 ratio 时取对比度较大的一端
+    """
+    background_luminance = np.asarray(background_luminance, dtype=np.float64)
+    lighter = target_luminance_for_contrast(background_luminance, ratio)
+    darker = (background_luminance + 0.05) / ratio - 0.05
+    lighter_end, darker_end = np.minimum(lighter, 1), np.maximum(darker, 0)
+    best_end = np.where(contrast_ratio(background_luminance, lighter_end)
+                        >= contrast_ratio(background_luminance, darker_end), lighter_end, darker_end)
+    return np.where(lighter <= 1, lighter, np.where(darker >= 0, darker, best_end))
+
+
+def adjust_to_target_luminance(colors, target_luminance, tolerance=1e-4):
+    """把每个颜色向白色混合（c + t * (255 - c)），取亮度达到目标的最小 t，返回 (uint8 颜色, t)
+
+    colors 为 (N, 3|4) 的调色板（也可为任意 (..., 3|4) 形状），target_luminance 可为标量或与 colors[..., 0]
+    可广播的数组；亮度已达标的颜色 t = 0 保持不变，目标超过 1（白色也达不到）时 t = 1。
+    亮度对 t 单调递增，所有颜色同时二分，迭代次数只取决于 tolerance
+    """
+    colors = np.asarray(colors)[..., :3]
+    shape = np.broadcast_shapes(colors.shape[:-1], np.shape(target_luminance))
+    colors = np.broadcast_to(colors, shape + (3,)).astype(np.float64)
+    target = np.broadcast_to(np.asarray(target_luminance, dtype=np.float64), shape)
+
+    low = np.zeros(shape)
+    high = np.ones(shape)
+    headroom = 255.0 - colors
+    for _ in range(max(1, int(np.ceil(np.log2(1.0 / tolerance))))):
+        mid = (low + high) / 2
+        below = luminance(colors + mid[..., None] * headroom) < target
+        low = np.where(below, mid, low)
+        high = np.where(below, high, mid)
+
+    # 已达标的颜色 t = 0
+    t = np.where(luminance(colors) >= target, 0.0, high)
+    adjusted = np.clip(np.round(colors + t[..., None] * headroom), 0, 255).astype(np.uint8)
+    return adjusted, t
@@ -0,0 +1,369 @@
+import numpy as np
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from utils.color import LUMA_BITS, contrast_target_luminance, relative_luminance
+
+# 分条处理的行数：临时数组保持在缓存大小附近
+STRIP_ROWS = 64
+
+# 覆盖率（alpha > 0 的像素占比）不超过该值时模板编译为稀疏形式，只处理被覆盖的像素
+# （稀疏路径每个像素的开销约为稠密路径的 6 倍，normal 模式的盈亏点约为 16%）
+SPARSE_MAX_COVERAGE = 0.15
+
+# adaptive 模式下水印与底图的目标对比度（WCAG 对比度，3.0 为大字号文字的可读下限）
+ADAPTIVE_CONTRAST = 3.0
+
+# 混合模式注册表：名称 -> 内核函数
+BLEND_MODES = {}
+
+
+class PreparedTemplate(NamedTuple):
+    """预处理后的水印模板（按输出尺寸裁剪，只构建一次）
+
+    稀疏形式下 index 为被覆盖像素在 (h, w, c) 中的扁平下标，其余数组压缩为 (n, c)
+    """
+    rgba: np.ndarray                    # (h, w, 4) uint8 原始 RGBA
+    premul: Optional[np.ndarray]        # (h, w, c) uint16 预乘 alpha：src * a + 128（已含 DIV255 的舍入项），仅 normal 模式
+    inv_alpha: np.ndarray               # (h, w, c) uint8 255 - a，按通道展开以避免广播乘法
+    color: Optional[np.ndarray] = None  # (h, w, c) uint8 水印颜色，仅其他混合模式
+    alpha: Optional[np.ndarray] = None  # (h, w, c) uint8 a，仅其他混合模式
+    blend_mode: str = "normal"
+    index: Optional[np.ndarray] = None  # (n * c,) intp 稀疏形式的元素下标，None 表示稠密
+
+
+class TiledTemplate(NamedTuple):
+    """周期性水印的一个周期 (h, w, 4) uint8，按坐标取模平铺到任意尺寸（见 template_region）"""
+    tile: np.ndarray
+
+
+def template_region(npy_data, width, height, top=0):
+    """取水印模板的 [top, top + height) 行、前 width 列
+
+    TiledTemplate 用 np.take 的 wrap 模式按坐标取模平铺，没有尺寸上限；
+    普通模板直接切片，比所需区域小的方向保持原尺寸（叠加时其余区域不受影响）
+    """
+    if isinstance(npy_data, TiledTemplate):
+        rows = np.take(npy_data.tile, np.arange(top, top + height), axis=0, mode="wrap")
+        return np.take(rows, np.arange(width), axis=1, mode="wrap")
+    return npy_data[top:top + height, :width]
+
+
+def _compile_sparse(template, coverage_mask, max_coverage=SPARSE_MAX_COVERAGE):
+    """覆盖率足够低时把模板压缩为稀疏形式：只保留 coverage_mask 为真的像素
+
+    下标按字节（像素下标 * 通道数 + 通道）展开，叠加时用一维 take/赋值收集与写回，
+    比按像素的二维花式索引快得多
+    """
+    pixels = np.flatnonzero(coverage_mask)
+    if pixels.size > coverage_mask.size * max_coverage:
+        return template
+    channels = template.inv_alpha.shape[-1]
+    index = (pixels[:, None] * channels + np.arange(channels)).ravel()
+
+    def compact(array):
+        return None if array is None else array.reshape(-1)[index].reshape(-1, channels)
+
+    return template._replace(premul=compact(template.premul), inv_alpha=compact(template.inv_alpha),
+                             color=compact(template.color), alpha=compact(template.alpha), index=index)
+
+
+def register_blend_mode(name):
+    """注册混合模式内核
+
+    内核签名为 kernel(dst, src, out, scratch)：dst 为底图条带 (uint8)，src 为水印颜色条带 (uint8)，
+    out/scratch 为同形状的 uint16 工作区；内核把混合色 B(dst, src)（0-255）写入 out
+    """
+    def decorator(func):
+        BLEND_MODES[name] = func
+        return func
+    return decorator
+
+
+def _div255(values, scratch):
+    """原地计算 round(values / 255)，与 PIL 的 DIV255 一致"""
+    values += 128
+    np.right_shift(values, 8, out=scratch)
+    values += scratch
+    values >>= 8
+    return values
+
+
+@register_blend_mode("multiply")
+def _multiply(dst, src, out, scratch):
+    """正片叠底：B = d * s / 255"""
+    np.multiply(dst, src, out=out, dtype=np.uint16)
+    _div255(out, scratch)
+
+
+@register_blend_mode("screen")
+def _screen(dst, src, out, scratch):
+    """滤色：B = d + s - d * s / 255"""
+    _multiply(dst, src, out, scratch)
+    np.add(dst, src, out=scratch, dtype=np.uint16)
+    np.subtract(scratch, out, out=out)
+
+
+@register_blend_mode("overlay")
+def _overlay(dst, src, out, scratch):
+    """叠加：d < 128 时 2ds，否则 1 - 2(1-d)(1-s)"""
+    _multiply(255 - dst, 255 - src, out, scratch)
+    out <<= 1
+    np.subtract(255, out, out=out)
+    low = np.multiply(dst, src, dtype=np.uint16)
+    _div255(low, scratch)
+    low <<= 1
+    np.copyto(out, low, where=dst < 128)
+
+
+@register_blend_mode("soft_light")
+def _soft_light(dst, src, out, scratch):
+    """柔光（pegtop）：B = (1 - 2s)d² + 2sd = d * (d + 2s(1 - d))"""
+    np.multiply(src, 255 - dst, out=out, dtype=np.uint16)
+    _div255(out, scratch)
+    out <<= 1
+    out += dst
+    out *= dst
+    _div255(out, scratch)
+
+
+# 自适应模式的定点查找表（亮度量化到 12 位，目标亮度与水印亮度都含 +0.05 的对比度偏移）
+_ADAPTIVE_BITS = 12
+_ADAPTIVE_OFFSET = round(0.05 * (1 << _ADAPTIVE_BITS))
+_level = np.arange(1 << _ADAPTIVE_BITS) / (1 << _ADAPTIVE_BITS)
+# 底图亮度 -> 与其对比度为 ADAPTIVE_CONTRAST 的目标亮度：暗底图上提亮，亮底图上压暗
+_target = contrast_target_luminance(_level, ADAPTIVE_CONTRAST)
+_ADAPTIVE_TARGET = (np.round(_target * (1 << _ADAPTIVE_BITS)) + _ADAPTIVE_OFFSET).astype(np.uint32)
+# 底图亮度 -> 缩放系数（1/256 定点）的上下限：提亮方向不低于 1，压暗方向不高于 1，
+# 已经比目标对比度更强的水印保持原色
+_lighter = _target >= _level
+_ADAPTIVE_MIN = np.where(_lighter, 256, 77).astype(np.uint32)
+_ADAPTIVE_MAX = np.where(_lighter, 768, 256).astype(np.uint32)
+# 水印亮度 -> 2^24 / (亮度 + 0.05)，用乘法和移位代替逐像素除法
+_ADAPTIVE_RECIPROCAL = np.round((1 << 24) / (np.arange(1 << _ADAPTIVE_BITS) + _ADAPTIVE_OFFSET)).astype(np.uint32)
+del _level, _target, _lighter
+
+
+@register_blend_mode("adaptive")
+def _adaptive(dst, src, out, scratch):
+    """自适应亮度：按底图亮度缩放水印颜色，B = s * clip((target(L_d) + 0.05) / (L_s + 0.05), lo, hi)
+
+    target(L_d) 为与底图对比度达到 ADAPTIVE_CONTRAST 的亮度（见 utils.color.contrast_target_luminance），
+    提亮时 [lo, hi] = [1, 3]，压暗时为 [0.3, 1]：水印只会被推向目标对比度，不会被拉回；
+    亮度为线性光下的相对亮度（查表完成 gamma 解码），缩放系数以 1/256 定点计算
+    """
+    shift = LUMA_BITS - _ADAPTIVE_BITS
+    level = relative_luminance(dst)
+    level >>= shift
+    scale = _ADAPTIVE_TARGET[level]
+    wm_luma = relative_luminance(src)
+    wm_luma >>= shift
+    scale *= _ADAPTIVE_RECIPROCAL[wm_luma]
+    scale >>= 16
+    np.clip(scale, _ADAPTIVE_MIN[level], _ADAPTIVE_MAX[level], out=scale)
+    adjusted = np.multiply(src[..., :3], scale[..., None], dtype=np.uint32)
+    adjusted += 128
+    adjusted >>= 8
+    np.minimum(adjusted, 255, out=adjusted)
+    out[..., :3] = adjusted
+
+
+def prepare_template(rgba, channels=3, blend_mode="normal", sparse=True):
+    """预计算水印模板，供 composite_over 反复使用
+
+    channels 为底图通道数（RGB 为 3，RGBA 为 4），数组按该通道数连续存放，
+    避免叠加时对 4 通道数组做跨步切片；normal 模式预乘 alpha，其他模式保存颜色与 alpha。
+    sparse 为真且覆盖率低于 SPARSE_MAX_COVERAGE 时编译为稀疏形式（alpha 为 0 的像素叠加前后不变）；
+    adaptive 模式逐像素开销大，不论覆盖率都编译为稀疏形式，只在 alpha > 0 处求值
+    """
+    if blend_mode != "normal" and blend_mode not in BLEND_MODES:
+        raise ValueError(f"不支持的混合模式: {blend_mode}，可选: {['normal', *BLEND_MODES]}")
+    rgba = np.ascontiguousarray(rgba)
+    alpha = rgba[..., 3:4]
+    inv_alpha = np.ascontiguousarray(np.broadcast_to(255 - alpha, rgba.shape[:2] + (channels,)))
+    if blend_mode == "normal":
+        premul = np.multiply(rgba[..., :channels], alpha, dtype=np.uint16)
+        premul += 128
+        template = PreparedTemplate(rgba, premul, inv_alpha)
+    else:
+        color = np.ascontiguousarray(rgba[..., :channels])
+        alpha = np.ascontiguousarray(np.broadcast_to(alpha, color.shape))
+        template = PreparedTemplate(rgba, None, inv_alpha, color, alpha, blend_mode)
+    if not sparse:
+        return template
+    return _compile_sparse(template, rgba[..., 3] > 0, 1.0 if blend_mode == "adaptive" else SPARSE_MAX_COVERAGE)
+
+
+# 亮度快速通道支持的混合模式：对无彩色水印，这些模式在 YCbCr 空间中都是逐像素线性的
+LUMA_BLEND_MODES = ("normal", "multiply", "screen")
+
+
+@lru_cache(maxsize=32)
+def opacity_lut(opacity):
+    """透明度查找表：a -> round(a * opacity / 100)，按透明度缓存（只读）"""
+    lut = np.floor((np.arange(256) * float(opacity) + 50) / 100).clip(0, 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def apply_opacity(rgba, opacity):
+    """按透明度缩放水印 alpha 通道，返回新数组；opacity 为 None 或不小于 100 时原样返回"""
+    if opacity is None or opacity >= 100:
+        return rgba
+    scaled = np.array(rgba)
+    np.take(opacity_lut(opacity), scaled[..., 3], out=scaled[..., 3])
+    return scaled
+
+
+def is_achromatic(rgba):
+    """判断水印可见部分（alpha > 0）是否为中性灰（R == G == B）"""
+    for top in range(0, rgba.shape[0], STRIP_ROWS * 16):
+        strip = rgba[top:top + STRIP_ROWS * 16]
+        visible = strip[..., 3] > 0
+        if np.any((strip[..., 0] != strip[..., 1])[visible]) or np.any((strip[..., 0] != strip[..., 2])[visible]):
+            return False
+    return True
+
+
+def prepare_luma_template(rgba, blend_mode="normal", sparse=True):
+    """为 YCbCr 底图预计算无彩色水印模板
+
+    灰度水印 g 的三种模式都可写成 out = dst * K + M（K、M 按 255 缩放）：
+    normal: K = 255 - a, M = g * a；multiply: K = 255 - a(255 - g)/255, M = 0；screen: K = 255 - a*g/255, M = g * a。
+    Y 通道直接套用；Cb/Cr 以 128 为中性点按同一 K 衰减：out = C * K + 128 * (255 - K)。
+    结果以 normal 模式模板的形式返回，由 composite_over 的 normal 分支完成叠加
+    """
+    if blend_mode not in LUMA_BLEND_MODES:
+        raise ValueError(f"亮度通道不支持混合模式: {blend_mode}，可选: {list(LUMA_BLEND_MODES)}")
+    rgba = np.ascontiguousarray(rgba)
+    gray = rgba[..., 0].astype(np.uint16)
+    alpha = rgba[..., 3].astype(np.uint16)
+    scratch = np.empty_like(gray)
+    if blend_mode == "normal":
+        keep = 255 - alpha
+        offset = gray * alpha
+    elif blend_mode == "multiply":
+        keep = 255 - _div255(alpha * (255 - gray), scratch)
+        offset = np.zeros_like(gray)
+    else:
+        keep = 255 - _div255(alpha * gray, scratch)
+        offset = gray * alpha
+
+    scale = np.repeat(keep.astype(np.uint8)[..., None], 3, axis=2)
+    premul = np.empty(scale.shape, dtype=np.uint16)
+    premul[..., 0] = offset
+    premul[..., 1] = (255 - keep) * 128
+    premul[..., 2] = premul[..., 1]
+    premul += 128
+    template = PreparedTemplate(rgba, premul, scale)
+    return _compile_sparse(template, keep < 255) if sparse else template
+
+
+def _scratch(scratch, name, shape, dtype=np.uint16):
+    """取工作区：有缓冲池时复用，否则新分配"""
+    if scratch is None:
+        return np.empty(shape, dtype=dtype)
+    return scratch.array(name, shape, dtype)
+
+
+def composite_over(base, template, scratch=None):
+    """将水印原地叠加到 uint8 底图 (H, W, 3|4) 的左上角；底图也可以是 (N, H, W, C) 的同尺寸批量，模板在批维度上广播
+
+    normal 模式与 PIL Image.paste(wm, (0, 0), wm) 的定点运算一致：
+    out = DIV255(dst * (255 - a) + src * a)，DIV255(v) = ((v + 128) + ((v + 128) >> 8)) >> 8
+    其他混合模式把 src 换成 B(dst, src)，每个条带只读写底图一次；底图 alpha 通道始终按 normal 混合。
+    稀疏模板只读写被覆盖的像素，开销随水印覆盖率而非图片面积增长。
+    scratch 为可选的缓冲池（utils.buffers.BufferPool），条带工作区从中复用
+    """
+    if template.index is not None:
+        return _composite_sparse(base, template, scratch)
+    height = min(base.shape[-3], template.inv_alpha.shape[0])
+    width = min(base.shape[-2], template.inv_alpha.shape[1])
+    channels = base.shape[-1]
+    if template.inv_alpha.shape[2] != channels:
+        raise ValueError(f"模板按 {template.inv_alpha.shape[2]} 通道预处理，底图为 {channels} 通道")
+    kernel = BLEND_MODES.get(template.blend_mode)
+
+    shape = base.shape[:-3] + (min(STRIP_ROWS, height), width, channels)
+    tmp = _scratch(scratch, "composite_tmp", shape)
+    carry = _scratch(scratch, "composite_carry", shape)
+    blended = _scratch(scratch, "composite_blended", shape) if kernel is not None else None
+    for top in range(0, height, STRIP_ROWS):
+        rows = min(STRIP_ROWS, height - top)
+        strip = slice(top, top + rows)
+        dst = base[..., strip, :width, :]
+        t, c = tmp[..., :rows, :, :], carry[..., :rows, :, :]
+        np.multiply(dst, template.inv_alpha[strip, :width], out=t, dtype=np.uint16)
+        if kernel is None:
+            t += template.premul[strip, :width]
+        else:
+            b = blended[..., :rows, :, :]
+            src = template.color[strip, :width]
+            kernel(dst, src, b, c)
+            if channels == 4:
+                b[..., 3] = src[..., 3]
+            b *= template.alpha[strip, :width]
+            t += b
+            t += 128
+        np.right_shift(t, 8, out=c)
+        t += c
+        t >>= 8
+        np.copyto(dst, t, casting="unsafe")
+    return base
+
+
+def _composite_sparse(base, template, scratch=None):
+    """稀疏模板的叠加：按扁平下标收集被覆盖的像素，分块计算后写回（运算与稠密路径一致）"""
+    template_height, template_width = template.rgba.shape[:2]
+    height, width, channels = base.shape[-3:]
+    if template.inv_alpha.shape[-1] != channels:
+        raise ValueError(f"模板按 {template.inv_alpha.shape[-1]} 通道预处理，底图为 {channels} 通道")
+    # 底图可以是每像素带填充字节的通道切片（缓冲池中按 PIL 内部布局存放的 RGB / YCbCr，每像素 4 字节）
+    pixel_stride = base.strides[-2]
+    if base.dtype != np.uint8 or base.strides[-1] != 1 or base.strides[-3] != width * pixel_stride:
+        raise ValueError("稀疏叠加要求底图数组按行连续存放（每像素可带填充字节）")
+
+    index = template.index
+    if template_width != width or template_height > height or pixel_stride != channels:
+        # 模板与底图宽度或像素步长不同：换算到底图坐标，并去掉超出底图的行列
+        pixel, channel = np.divmod(index, channels)
+        rows, cols = np.divmod(pixel, template_width)
+        keep = (rows < height) & (cols < width)
+        index = (rows * width + cols) * pixel_stride + channel
+        if not keep.all():
+            index = index[keep]
+            keep = keep[::channels]
+            template = template._replace(**{field: getattr(template, field)[keep]
+                                            for field in ("premul", "inv_alpha", "color", "alpha")
+                                            if getattr(template, field) is not None})
+
+    flat = np.lib.stride_tricks.as_strided(base, base.shape[:-3] + (height * width * pixel_stride,),
+                                           base.strides[:-3] + (1,))
+    kernel = BLEND_MODES.get(template.blend_mode)
+    step = STRIP_ROWS * 4096
+    for start in range(0, index.size // channels, step):
+        part = slice(start, start + step)
+        idx = index[start * channels:(start + step) * channels]
+        gathered = _scratch(scratch, "composite_gather", base.shape[:-3] + (idx.size,), np.uint8)
+        np.take(flat, idx, axis=-1, out=gathered)
+        dst = gathered.reshape(base.shape[:-3] + (-1, channels))
+        t = _scratch(scratch, "composite_tmp", dst.shape)
+        np.multiply(dst, template.inv_alpha[part], out=t, dtype=np.uint16)
+        c = _scratch(scratch, "composite_carry", dst.shape)
+        if kernel is None:
+            t += template.premul[part]
+        else:
+            b = _scratch(scratch, "composite_blended", dst.shape)
+            src = template.color[part]
+            kernel(dst, src, b, c)
+            if channels == 4:
+                b[..., 3] = src[..., 3]
+            b *= template.alpha[part]
+            t += b
+            t += 128
+        np.right_shift(t, 8, out=c)
+        t += c
+        t >>= 8
+        np.copyto(dst, t, casting="unsafe")
+        flat[..., idx] = gathered
+    return base
@@ -0,0 +1,335 @@
+import numpy as np
+from functools import lru_cache
+from typing import NamedTuple
+from PIL import Image, ImageDraw, ImageFont
+
+# 亮度阈值：区域平均亮度高于该值时用黑色文字，否则用白色
+BRIGHTNESS_THRESHOLD = 127
+
+# 批量叠加印章时每块处理的像素数上限（印章数 × 印章面积），限制临时下标数组的大小
+STAMP_CHUNK_PIXELS = 1 << 22
+
+
+class BrightnessSampler:
+    """积分图（summed-area table）亮度采样
+
+    构造时只做一次灰度转换；查询时把所有矩形的上下边界收集起来，一次扫描整图得到这些行上的积分图，
+    之后每个矩形的灰度总和只需查 4 个角点。所有水印位置一次性向量化查询，不再逐个裁剪、转灰度、算直方图
+    """
+
+    def __init__(self, image):
+        self.gray = np.asarray(image.convert("L"))
+        self.height, self.width = self.gray.shape
+
+    def _prefix_rows(self, rows):
+        """rows 为升序的行边界，返回 table[i, x] = gray[:rows[i], :x] 的总和"""
+        table = np.zeros((rows.size, self.width + 1), dtype=np.int64)
+        running = np.zeros(self.width, dtype=np.int64)
+        previous = 0
+        for i, row in enumerate(rows.tolist()):
+            if row > previous:
+                # 相邻边界之间的行按列求和（连续内存，比沿 axis=0 的 cumsum 快得多）
+                running += self.gray[previous:row].sum(axis=0, dtype=np.uint32)
+                previous = row
+            table[i, 1:] = running
+        np.cumsum(table, axis=1, out=table)
+        return table
+
+    def region_sum(self, x, y, width, height):
+        """矩形 [x, x + width) × [y, y + height) 内的灰度总和，参数可为数组；超出图片的部分按 0 计"""
+        x0 = np.clip(x, 0, self.width)
+        y0 = np.clip(y, 0, self.height)
+        x1 = np.clip(np.add(x, width), 0, self.width)
+        y1 = np.clip(np.add(y, height), 0, self.height)
+        rows = np.unique(np.concatenate([np.ravel(y0), np.ravel(y1)]))
+        table = self._prefix_rows(rows)
+        r0 = np.searchsorted(rows, y0)
+        r1 = np.searchsorted(rows, y1)
+        return table[r1, x1] - table[r0, x1] - table[r1, x0] + table[r0, x0]
+
+    def mean(self, x, y, width, height):
+        """矩形的平均亮度（0-255）
+
+        与 image.crop(...).convert("L") 的直方图均值一致：超出图片的部分按黑色计入，分母始终为 width * height
+        """
+        return self.region_sum(x, y, width, height) / (np.asarray(width) * np.asarray(height))
+
+
+def calculate_brightness(image, x, y, text_width, text_height):
+    """计算指定区域的平均亮度（单次查询；多个区域请直接使用 BrightnessSampler）"""
+    return float(BrightnessSampler(image).mean(x, y, text_width, text_height))
+
+
+class StampSprite(NamedTuple):
+    """预渲染的文字印章"""
+    mask: np.ndarray  # (h, w) uint8 字形覆盖度，只包含墨迹包围盒
+    offset: tuple     # 包围盒左上角相对 draw.text 坐标的偏移 (dx, dy)
+
+
+@lru_cache(maxsize=32)
+def stamp_sprite(text, font_path, font_size):
+    """渲染一次文字覆盖度掩码，按 (文字, 字体, 字号) 缓存（只读）"""
+    font = ImageFont.truetype(font_path, font_size)
+    left, top, right, bottom = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox((0, 0), text, font=font)
+    # 包围盒可能有负偏移，画布向左上扩展后再裁回包围盒
+    pad_x, pad_y = max(-left, 0), max(-top, 0)
+    canvas = Image.new("L", (right + pad_x, bottom + pad_y), 0)
+    ImageDraw.Draw(canvas).text((pad_x, pad_y), text, font=font, fill=255)
+    mask = np.array(canvas)[top + pad_y:, left + pad_x:]
+    mask.flags.writeable = False
+    return StampSprite(mask, (left, top))
+
+
+def random_positions(image_size, stamp_size, count, seed=None, gap=0, max_attempts=None):
+    """在图内随机放置最多 count 个互不重叠的印章，返回 (xs, ys)
+
+    候选位置由 seed 确定的随机数生成器批量生成，碰撞检测用空间哈希：格子边长为印章尺寸加间距，
+    每个格子最多容纳一个印章，每个候选只需检查周围 3×3 个格子。放不下时返回的数量少于 count
+    """
+    width, height = image_size
+    stamp_width, stamp_height = stamp_size
+    cell_width, cell_height = stamp_width + gap, stamp_height + gap
+    rng = np.random.default_rng(seed)
+    max_attempts = max_attempts or count * 20
+    candidates_x = rng.integers(0, max(width - stamp_width, 0), max_attempts, endpoint=True)
+    candidates_y = rng.integers(0, max(height - stamp_height, 0), max_attempts, endpoint=True)
+
+    grid = {}
+    xs, ys = [], []
+    for x, y in zip(candidates_x.tolist(), candidates_y.tolist()):
+        cx, cy = x // cell_width, y // cell_height
+        if any(abs(x - ox) < cell_width and abs(y - oy) < cell_height
+               for ox, oy in (grid.get((cx + i, cy + j), (-cell_width, -cell_height))
+                              for i in (-1, 0, 1) for j in (-1, 0, 1))):
+            continue
+        grid[(cx, cy)] = (x, y)
+        xs.append(x)
+        ys.append(y)
+        if len(xs) == count:
+            break
+    return np.array(xs, dtype=np.intp), np.array(ys, dtype=np.intp)
+
+
+def overlap_layers(xs, ys, stamp_size):
+    """把可能重叠的印章分层：同一层内互不重叠，且重叠的印章保持原来的先后顺序
+
+    每个印章的层号为与它重叠的、更早的印章的最大层号加一；空间哈希格子边长为印章尺寸
+    """
+    stamp_width, stamp_height = stamp_size
+    grid = {}
+    layers = np.zeros(len(xs), dtype=np.intp)
+    for n, (x, y) in enumerate(zip(np.ravel(xs).tolist(), np.ravel(ys).tolist())):
+        cx, cy = x // stamp_width, y // stamp_height
+        layer = 0
+        for i in (-1, 0, 1):
+            for j in (-1, 0, 1):
+                for ox, oy, other in grid.get((cx + i, cy + j), ()):
+                    if abs(x - ox) < stamp_width and abs(y - oy) < stamp_height:
+                        layer = max(layer, other + 1)
+        grid.setdefault((cx, cy), []).append((x, y, layer))
+        layers[n] = layer
+    return layers
+
+
+def composite_stamps(base, sprite, xs, ys, colors):
+    """把印章以各自的颜色原地叠加到 uint8 底图 (H, W, C)，一批印章一次完成
+
+    xs/ys 为 draw.text 坐标，colors 为 (n, C) 颜色；同一次调用内的印章不能重叠（先用 overlap_layers 分层）。
+    运算与 ImageDraw.text 的定点混合一致：out = DIV255(dst * (255 - m) + color * m)
+    """
+    height, width, channels = base.shape
+    mask = sprite.mask
+    stamp_height, stamp_width = mask.shape
+    xs = np.asarray(xs, dtype=np.intp) + sprite.offset[0]
+    ys = np.asarray(ys, dtype=np.intp) + sprite.offset[1]
+    colors = np.asarray(colors, dtype=np.uint16)
+    flat = base.reshape(-1, channels)
+    # 只处理有墨迹的像素
+    rows, cols = np.nonzero(mask)
+    coverage = mask[rows, cols].astype(np.uint16)
+    step = max(1, STAMP_CHUNK_PIXELS // max(rows.size, 1))
+    for start in range(0, len(xs), step):
+        y = ys[start:start + step, None] + rows
+        x = xs[start:start + step, None] + cols
+        inside = (y >= 0) & (y < height) & (x >= 0) & (x < width)
+        index = (y * width + x)[inside]
+        alpha = np.broadcast_to(coverage, inside.shape)[inside][:, None]
+        color = np.broadcast_to(colors[start:start + step, None, :], inside.shape + (channels,))[inside]
+        values = flat[index] * (255 - alpha) + color * alpha
+        values += 128
+        values += values >> 8
+        values >>= 8
+        flat[index] = values
+    return base
+
+
+def _drawable(image):
+    """RGB/RGBA/YCbCr/L 以外的模式（P、1、I;16 等）先转换为 RGB(A) 再画文字"""
+    if image.mode in ("RGB", "RGBA", "YCbCr", "L"):
+        return image
+    has_alpha = "A" in image.mode or "transparency" in image.info
+    return image.convert("RGBA" if has_alpha else "RGB")
+
+
+def _mode_color(image, rgb):
+    """RGB 颜色换算到图片模式（RGBA 图片的文字像素不透明）"""
+    if image.mode == "RGBA":
+        return tuple(rgb[:3]) + (255,)
+    return Image.new("RGB", (1, 1), tuple(rgb[:3])).convert(image.mode).getpixel((0, 0))
+
+
+def _stamp_by_brightness(image, text, font_path, font_size, xs, ys, pixels=None):
+    """按各位置背景亮度选择黑/白文字，分层后批量叠加；亮度在叠加前对原图一次性采样
+
+    pixels 为 image 的像素数组视图（如缓冲池中的画布）时直接原地叠加，不再复制整帧
+    """
+    sprite = stamp_sprite(text, font_path, font_size)
+    text_height, text_width = sprite.mask.shape
+    xs, ys = np.ravel(xs), np.ravel(ys)
+    if xs.size == 0:
+        return image
+    image = _drawable(image)
+    brightness = BrightnessSampler(image).mean(xs, ys, text_width, text_height)
+    palette = np.array([_mode_color(image, (255, 255, 255)), _mode_color(image, (0, 0, 0))])
+    colors = palette[(brightness > BRIGHTNESS_THRESHOLD).astype(np.intp)].reshape(xs.size, -1)
+    base = np.array(image) if pixels is None else pixels
+    layers = overlap_layers(xs, ys, (text_width, text_height))
+    for layer in range(layers.max() + 1):
+        selected = layers == layer
+        composite_stamps(base.reshape(base.shape[:2] + (-1,)), sprite, xs[selected], ys[selected], colors[selected])
+    if pixels is None:
+        image.paste(Image.fromarray(base, image.mode))
+    return image
+
+
+def add_tiled_watermark(image, text, font_path="arial.ttf", font_size=30, spacing=100, pixels=None):
+    """平铺水印，并根据背景亮度动态调整颜色"""
+    text_height, text_width = stamp_sprite(text, font_path, font_size).mask.shape
+    ys, xs = np.meshgrid(np.arange(0, image.height, text_height + spacing),
+                         np.arange(0, image.width, text_width + spacing), indexing="ij")
+    return _stamp_by_brightness(image, text, font_path, font_size, xs, ys, pixels)
+
+
+def scattered_positions(image_size, sprite, margin=10):
+    """四角加中心的 draw.text 坐标 (xs, ys)：按印章墨迹包围盒的实际尺寸留出 margin，长文字也不会伸出图片或彼此重叠"""
+    width, height = image_size
+    text_height, text_width = sprite.mask.shape
+    left, top = margin, margin
+    right, bottom = width - text_width - margin, height - text_height - margin
+    center_x, center_y = (width - text_width) // 2, (height - text_height) // 2
+    # 左上、右上、左下、右下、中心
+    xs = np.array([left, right, left, right, center_x], dtype=np.intp) - sprite.offset[0]
+    ys = np.array([top, top, bottom, bottom, center_y], dtype=np.intp) - sprite.offset[1]
+    return xs, ys
+
+
+def add_scattered_watermark(image, text, font_path="arial.ttf", font_size=30, positions=None, pixels=None):
+    """分散水印（默认四角加中心，按文字尺寸定位），并根据背景亮度动态调整颜色"""
+    if positions is None:
+        xs, ys = scattered_positions(image.size, stamp_sprite(text, font_path, font_size))
+    else:
+        xs, ys = np.asarray(positions, dtype=np.intp).reshape(-1, 2).T
+    return _stamp_by_brightness(image, text, font_path, font_size, xs, ys, pixels)
+
+
+def add_random_watermark(image, text, font_path="arial.ttf", font_size=30, num_watermarks=10, seed=None, gap=0,
+                         pixels=None):
+    """随机分布水印（互不重叠，间距至少 gap），并根据背景亮度动态调整颜色；seed 相同时位置可复现"""
+    text_height, text_width = stamp_sprite(text, font_path, font_size).mask.shape
+    xs, ys = random_positions(image.size, (text_width, text_height), num_watermarks, seed, gap)
+    return _stamp_by_brightness(image, text, font_path, font_size, xs, ys, pixels)
+
+
+@lru_cache(maxsize=8)
+def load_font(font_path, font_size):
+    """按 (字体文件, 字号) 缓存字体对象"""
+    return ImageFont.truetype(font_path, font_size)
+
+
+class Glyph(NamedTuple):
+    """单个字符的覆盖度掩码，位置相对基线原点"""
+    mask: np.ndarray  # (h, w) uint8
+    left: int
+    top: int
+    advance: float
+
+
+@lru_cache(maxsize=4096)
+def glyph(char, font_path, font_size):
+    """渲染单个字符，按 (字符, 字体, 字号) 缓存（只读）；逐图变化的文字由缓存的字形拼接，不再逐张调用 FreeType"""
+    font = load_font(font_path, font_size)
+    left, top, right, bottom = font.getbbox(char, anchor="ls")
+    canvas = Image.new("L", (max(right - left, 0), max(bottom - top, 0)), 0)
+    if canvas.width and canvas.height:
+        ImageDraw.Draw(canvas).text((-left, -top), char, font=font, fill=255, anchor="ls")
+    mask = np.array(canvas)
+    mask.flags.writeable = False
+    return Glyph(mask, left, top, font.getlength(char))
+
+
+def render_text_mask(text, font_path, font_size):
+    """用缓存的字形拼出单行文字的覆盖度掩码 (h, w)（不做字距调整）"""
+    ascent, descent = load_font(font_path, font_size).getmetrics()
+    glyphs = []
+    pen = 0.0
+    for char in text:
+        item = glyph(char, font_path, font_size)
+        glyphs.append((round(pen) + item.left, ascent + item.top, item.mask))
+        pen += item.advance
+    glyphs = [(x, y, mask) for x, y, mask in glyphs if mask.size]
+    if not glyphs:
+        return np.zeros((0, 0), dtype=np.uint8)
+    shift_x = -min(min(x for x, _, _ in glyphs), 0)
+    shift_y = -min(min(y for _, y, _ in glyphs), 0)
+    width = max(x + mask.shape[1] for x, _, mask in glyphs) + shift_x
+    height = max(max(y + mask.shape[0] for _, y, mask in glyphs), ascent + descent) + shift_y
+    canvas = np.zeros((height, width), dtype=np.uint8)
+    for x, y, mask in glyphs:
+        region = canvas[y + shift_y:y + shift_y + mask.shape[0], x + shift_x:x + shift_x + mask.shape[1]]
+        # 相邻字形可能重叠，取覆盖度较大者
+        np.maximum(region, mask, out=region)
+    return canvas
+
+
+# 动态文字的排布方式：corner 单处（按 TEXT_POSITIONS 定位），其余三种按各位置底图亮度取黑/白文字
+TEXT_STYLES = ("corner", "tiled", "scattered", "random")
+
+# 动态文字的锚点：(水平, 垂直)，0 为左/上，1 为右/下，0.5 为居中
+TEXT_POSITIONS = {
+    "top_left": (0, 0),
+    "top_right": (1, 0),
+    "bottom_left": (0, 1),
+    "bottom_right": (1, 1),
+    "center": (0.5, 0.5),
+}
+
+
+def stamp_text(image, text, font_path, font_size, fill=(255, 255, 255, 255), position="bottom_right", margin=20):
+    """在图片的指定角落叠加一行文字，只处理文字所在的包围盒；返回图片（可能是转换模式后的新图片）
+
+    fill 为 RGB 或 RGBA 颜色，alpha 作为不透明度并入掩码；fill 为 "auto" 时按文字所在区域的底图亮度取黑/白。
+    RGB/RGBA/YCbCr/L 以外的模式先转换为 RGB(A)
+    """
+    if position not in TEXT_POSITIONS:
+        raise ValueError(f"不支持的文字位置: {position}，可选: {list(TEXT_POSITIONS)}")
+    mask = render_text_mask(text, font_path, font_size)
+    if not mask.size:
+        return image
+
+    image = _drawable(image)
+    text_height, text_width = mask.shape
+    anchor_x, anchor_y = TEXT_POSITIONS[position]
+    x = round(margin + (image.width - 2 * margin - text_width) * anchor_x)
+    y = round(margin + (image.height - 2 * margin - text_height) * anchor_y)
+
+    if isinstance(fill, str) and fill == "auto":
+        # 只对文字包围盒采样，不必对整张输出图做灰度转换
+        brightness = BrightnessSampler(image.crop((x, y, x + text_width, y + text_height))).mean(
+            0, 0, text_width, text_height)
+        fill = (0, 0, 0) if brightness > BRIGHTNESS_THRESHOLD else (255, 255, 255)
+    fill = tuple(fill)
+    alpha = fill[3] if len(fill) == 4 else 255
+    if alpha < 255:
+        mask = ((mask.astype(np.uint16) * alpha + 127) // 255).astype(np.uint8)
+    image.paste(_mode_color(image, fill), (x, y), Image.fromarray(mask))
+    return image